@@ -1,115 +1,777 @@
 # --- Imports ---
 import random
 import logging
+import logging.handlers
 import time
 import json
 import os
 import sys
 import re
-import requests
-from plexapi.server import PlexServer
-from plexapi.exceptions import NotFound, BadRequest
-from datetime import datetime, timedelta
+import threading
+import bisect
+import queue
+import atexit
+import importlib.util
+import hashlib
+import contextlib
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from datetime import datetime, timedelta, date
 
 # --- Configuration & Constants ---
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
 LOG_DIR = 'logs'
 LOG_FILE = os.path.join(LOG_DIR, 'collexions.log')
-SELECTED_COLLECTIONS_FILE = 'selected_collections.json'
+LOG_MAX_BYTES = 5 * 1024 * 1024 # rotate collexions.log at this size
+LOG_BACKUP_COUNT = 5 # rotated files kept (collexions.log.1 ... .5)
+SELECTED_COLLECTIONS_FILE = 'selected_collections.json' # legacy history format, migrated on first run
+PIN_HISTORY_FILE = 'selected_collections.jsonl'
+PIN_HISTORY_RETENTION_DAYS = 365
+PIN_HISTORY_COMPACT_EVERY = 100 # log lines compaction would drop (superseded or expired) before it runs
+COLLECTION_CACHE_FILE = 'collections_cache.json'
+COLLECTION_CACHE_VERSION = 1
+COLLECTION_CACHE_FULL_REFRESH_HOURS = 24
+ROTATION_DECK_FILE = 'rotation_deck.json'
+ROTATION_DECK_VERSION = 1
+RECENTLY_UPDATED_HALF_LIFE_DAYS = 30 # rotation_weight 'recently_updated': weight bonus halves every 30 days
+CYCLE_JOURNAL_FILE = 'cycle_journal.json'
+CYCLE_JOURNAL_VERSION = 1
+COLLECTION_PAGE_SIZE = 500 # collections per listing request (X-Plex-Container-Size)
+COLLECTION_LISTING_EXCLUDED_FIELDS = 'summary,tagline,thumb,art,theme,composite' # not read by the selector
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+RECONNECT_BASE_DELAY = 15 # seconds, doubled per consecutive connection failure
+LABEL_EDIT_BATCH_SIZE = 100 # collections per multi-edit request (keeps the URL short)
+DISCORD_MAX_ATTEMPTS = 5
+DISCORD_MESSAGE_LIMIT = 2000 # Discord's maximum message content length
+LIBRARY_CHANGE_DEBOUNCE = 30 # seconds to collect library change events before acting on them
+OWN_CHANGE_GRACE = 120 # seconds after a cycle during which collection events are our own edits
+# Exit codes (2 is argparse's usage error)
+EXIT_OK = 0
+EXIT_CONFIG_ERROR = 1 # also unhandled exceptions
+EXIT_PLEX_UNREACHABLE = 3
+EXIT_CYCLE_ERRORS = 4 # the cycle ran but some steps failed (see the cycle summary)
 
 # --- Setup Logging ---
-if not os.path.exists(LOG_DIR):
-    try: os.makedirs(LOG_DIR)
-    except OSError as e: sys.stderr.write(f"Error creating log dir: {e}\n"); LOG_FILE = None
-
-log_handlers = [logging.StreamHandler(sys.stdout)]
-if LOG_FILE:
-    try: log_handlers.append(logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8'))
-    except Exception as e: sys.stderr.write(f"Error setting up file log: {e}\n")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(funcName)s] %(message)s',
-    handlers=log_handlers
-)
+_log_listener = None
+
+def setup_logging(stream=None, to_file=True):
+    """Creates the log dir and starts the queued console + rotating file logging (once; stream defaults to stdout)."""
+    global _log_listener
+    if _log_listener is not None: return
+    log_file = LOG_FILE if to_file else None
+    if log_file and not os.path.exists(LOG_DIR):
+        try: os.makedirs(LOG_DIR)
+        except OSError as e: sys.stderr.write(f"Error creating log dir: {e}\n"); log_file = None
+
+    log_handlers = [logging.StreamHandler(stream or sys.stdout)]
+    if log_file:
+        try: log_handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'))
+        except Exception as e: sys.stderr.write(f"Error setting up file log: {e}\n")
+    log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(funcName)s] %(message)s')
+    for handler in log_handlers: handler.setFormatter(log_formatter)
+
+    # Callers only enqueue records; one background thread formats and writes them, so log I/O never blocks a cycle
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    # atexit hooks run last-in first-out: re-register the notifier so it flushes (and logs) before the listener stops
+    atexit.unregister(_discord_notifier.close); atexit.register(_discord_notifier.close)
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+    logging.getLogger().setLevel(logging.INFO)
+
+def set_log_level(level_name):
+    """Applies the optional 'log_level' config setting (DEBUG adds per-collection detail); INFO when unset or invalid."""
+    level = logging.getLevelName(level_name.upper()) if isinstance(level_name, str) else None
+    if not isinstance(level, int):
+        if level_name is not None: logging.warning(f"Invalid 'log_level': {level_name}. Using INFO.")
+        level = logging.INFO
+    root = logging.getLogger()
+    if root.level != level: root.setLevel(level); logging.info(f"Log level set to {logging.getLevelName(level)}.")
+
+# --- Concurrency Helpers ---
+_log_buffer = threading.local()
+_cycle_context = threading.local()
+
+def current_server():
+    """Name of the server the calling thread is working for (None in single-server mode)."""
+    return getattr(_cycle_context, 'server', None)
+
+@contextlib.contextmanager
+def server_context(name):
+    """Marks the calling thread (and the pool tasks it submits via map_ordered) as working for server name."""
+    outer = current_server()
+    _cycle_context.server = name
+    try: yield
+    finally: _cycle_context.server = outer
+
+class _ServerLogFilter(logging.Filter):
+    """Prefixes records with the server name in multi-server mode (once, when the record is created)."""
+    def filter(self, record):
+        server = current_server()
+        if server and not hasattr(record, 'server'):
+            record.server = server
+            record.msg = f"[{server.replace('%', '%%') if record.args else server}] {record.msg}"
+        return True
+
+class _BufferedLogFilter(logging.Filter):
+    """Holds records logged inside a worker task so they can be replayed in submission order."""
+    def filter(self, record):
+        records = getattr(_log_buffer, 'records', None)
+        if records is None: return True
+        records.append(record)
+        return False
+
+logging.getLogger().addFilter(_ServerLogFilter())
+logging.getLogger().addFilter(_BufferedLogFilter())
+
+# --- Lazy Imports ---
+# requests and plexapi make up most of the start-up time, so they are imported on first use (connect_to_plex,
+# get_http_session). Everything that touches Plex runs after that; until then these names are None.
+requests = PlexServer = NotFound = BadRequest = FilterChoice = EditTagsMixin = BoundedSession = None
+_import_lock = threading.Lock()
+
+def _define_bounded_session():
+    class BoundedSession(requests.Session):
+        """requests.Session that caps the number of concurrent requests to one server."""
+        def __init__(self, max_concurrent):
+            super().__init__()
+            self._slots = threading.BoundedSemaphore(max_concurrent)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent)
+            self.mount('http://', adapter); self.mount('https://', adapter)
+
+        def request(self, method, url, *args, **kwargs):
+            with self._slots:
+                start = time.perf_counter()
+                try: response = super().request(method, url, *args, **kwargs)
+                except Exception: get_metrics().observe_request(method, url, time.perf_counter() - start, 'error'); raise
+                get_metrics().observe_request(method, url, time.perf_counter() - start, response.status_code)
+                return response
+    return BoundedSession
+
+def import_plex_modules():
+    """Imports requests and plexapi into the module namespace (once, thread-safe)."""
+    global requests, PlexServer, NotFound, BadRequest, FilterChoice, EditTagsMixin, BoundedSession
+    with _import_lock:
+        if BoundedSession is not None: return
+        import requests.adapters # the global declaration makes these imports bind module-level names
+        from plexapi.server import PlexServer
+        from plexapi.exceptions import NotFound, BadRequest
+        from plexapi.library import FilterChoice
+        from plexapi.mixins import EditTagsMixin
+        BoundedSession = _define_bounded_session()
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Returns the shared keep-alive requests.Session used for non-Plex HTTP calls (e.g. Discord)."""
+    global _http_session
+    import_plex_modules()
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=DEFAULT_MAX_WORKERS)
+            _http_session.mount('http://', adapter); _http_session.mount('https://', adapter)
+        return _http_session
+
+def get_concurrency_limits(config):
+    """Returns (max_workers, max_concurrent_requests_per_server) from config with defaults."""
+    max_workers = config.get('max_workers', DEFAULT_MAX_WORKERS)
+    if not isinstance(max_workers, int) or max_workers < 1:
+        logging.warning(f"Invalid 'max_workers', defaulting {DEFAULT_MAX_WORKERS}."); max_workers = DEFAULT_MAX_WORKERS
+    max_requests = config.get('max_concurrent_requests_per_server', DEFAULT_MAX_CONCURRENT_REQUESTS)
+    if not isinstance(max_requests, int) or max_requests < 1:
+        logging.warning(f"Invalid 'max_concurrent_requests_per_server', defaulting {DEFAULT_MAX_CONCURRENT_REQUESTS}."); max_requests = DEFAULT_MAX_CONCURRENT_REQUESTS
+    return max_workers, max_requests
+
+def _run_buffered(func, item, server=None):
+    """Runs func(item) for server capturing its log records; returns (result, error, records)."""
+    outer = getattr(_log_buffer, 'records', None)
+    _log_buffer.records = []
+    try:
+        with server_context(server):
+            try: return func(item), None, _log_buffer.records
+            except Exception as e: return None, e, _log_buffer.records
+    finally: _log_buffer.records = outer
+
+def map_ordered(executor, func, items):
+    """Runs func over items (on executor if given), yielding (item, result, error) and replaying logs in item order."""
+    items = list(items)
+    if executor is None:
+        for item in items:
+            try: yield item, func(item), None
+            except Exception as e: yield item, None, e
+        return
+    futures = [executor.submit(_run_buffered, func, item, current_server()) for item in items]
+    for item, future in zip(items, futures):
+        result, error, records = future.result()
+        for record in records: logging.getLogger().handle(record)
+        yield item, result, error
+
+# --- Metrics ---
+_ENDPOINT_ID_RE = re.compile(r'custom\.collection\.[\d.]+|\d+(?:,\d+)*')
+
+def _endpoint(url):
+    """Reduces a request URL to its endpoint, e.g. '/library/metadata/{id}'."""
+    path = urlsplit(url).path or '/'
+    return _ENDPOINT_ID_RE.sub(lambda m: '{hub}' if m.group(0).startswith('custom') else '{id}', path)
+
+def _prom_value(value):
+    return str(int(value)) if isinstance(value, int) else repr(float(value)) # repr keeps full precision (epoch timestamps)
+
+def _prom_labels(**labels):
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+class CycleMetrics:
+    """Thread-safe per-cycle phase timings, Plex request stats and collection counts, plus a few running totals.
+
+    Phase seconds are summed over worker threads, so a phase fanned out over N workers can exceed wall time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cycles_total = 0
+        self.requests_total = {} # (server, method, endpoint, status) -> count since start
+        self.last_success = None
+        self._last = None # snapshot of the last finished cycle
+        self.start_cycle()
+
+    def start_cycle(self):
+        """Resets the per-cycle measurements."""
+        with self._lock:
+            self.cycle_started = time.time()
+            self.phases = {} # (phase, server, library) -> [seconds, calls, errors]
+            self.requests = {} # (server, method, endpoint) -> [count, seconds, max seconds, errors]
+            self.counts = {} # (server, library, state) -> value
+
+    @contextlib.contextmanager
+    def phase(self, name, library=''):
+        """Times the block as one call of a phase; an exception escaping the block counts as an error."""
+        start = time.perf_counter(); failed = False
+        try: yield
+        except Exception: failed = True; raise
+        finally:
+            with self._lock:
+                stats = self.phases.setdefault((name, current_server() or '', library or ''), [0.0, 0, 0])
+                stats[0] += time.perf_counter() - start; stats[1] += 1; stats[2] += failed
+
+    def error(self, name, library=''):
+        """Counts an error that was handled inside a phase."""
+        with self._lock: self.phases.setdefault((name, current_server() or '', library or ''), [0.0, 0, 0])[2] += 1
+
+    def observe_request(self, method, url, seconds, status):
+        """Records one Plex HTTP request; status is the HTTP status code or 'error'."""
+        key = (current_server() or '', method, _endpoint(url))
+        failed = not isinstance(status, int) or status >= 400
+        with self._lock:
+            stats = self.requests.setdefault(key, [0, 0.0, 0.0, 0])
+            stats[0] += 1; stats[1] += seconds; stats[2] = max(stats[2], seconds); stats[3] += failed
+            total_key = key + (str(status),)
+            self.requests_total[total_key] = self.requests_total.get(total_key, 0) + 1
+
+    def set_count(self, library, state, value):
+        """Sets a per-library collection count (e.g. eligible, excluded, pinned) for this cycle."""
+        with self._lock: self.counts[(current_server() or '', library, state)] = value
+
+    def finish_cycle(self, success=True):
+        """Closes the cycle and returns its JSON-serialisable summary."""
+        with self._lock:
+            now = time.time()
+            self.cycles_total += 1
+            if success: self.last_success = now
+            self._last = {'duration': now - self.cycle_started, 'phases': dict(self.phases), 'requests': dict(self.requests), 'counts': dict(self.counts)}
+            phases, libraries = {}, {}
+            library_key = lambda server, library: f"{server}/{library}" if server else library # servers namespace libraries
+            for (name, server, library), (seconds, calls, errors) in sorted(self.phases.items()):
+                for target in [phases] + ([libraries.setdefault(library_key(server, library), {}).setdefault('phases', {})] if library else []):
+                    entry = target.setdefault(name, {'seconds': 0.0, 'calls': 0, 'errors': 0})
+                    entry['seconds'] = round(entry['seconds'] + seconds, 4); entry['calls'] += calls; entry['errors'] += errors
+            for (server, library, state), value in sorted(self.counts.items()): libraries.setdefault(library_key(server, library), {})[state] = value
+            endpoints = {}
+            for (server, method, endpoint), (count, seconds, longest, errors) in sorted(self.requests.items()):
+                entry = endpoints.setdefault(f"{method} {endpoint}", {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0})
+                entry['count'] += count; entry['seconds'] = round(entry['seconds'] + seconds, 4)
+                entry['max_seconds'] = round(max(entry['max_seconds'], longest), 4); entry['errors'] += errors
+            return {'started': datetime.fromtimestamp(self.cycle_started).strftime('%Y-%m-%d %H:%M:%S'), 'success': success,
+                    'duration_seconds': round(now - self.cycle_started, 4), 'phases': phases, 'libraries': libraries,
+                    'http': {'requests': sum(e['count'] for e in endpoints.values()), 'errors': sum(e['errors'] for e in endpoints.values()), 'endpoints': endpoints}}
+
+    def render_prometheus(self):
+        """Returns the last finished cycle (and running totals) in the Prometheus text exposition format."""
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+            lines.extend(f"{name}{_prom_labels(**labels) if labels else ''} {_prom_value(value)}" for labels, value in samples)
+        with self._lock:
+            last = self._last or {'duration': 0.0, 'phases': {}, 'requests': {}, 'counts': {}}
+            metric('collexions_cycles_total', 'counter', "Cycles run since start.", [({}, self.cycles_total)])
+            if self.last_success: metric('collexions_last_success_timestamp_seconds', 'gauge', "End of the last cycle that reached Plex.", [({}, self.last_success)])
+            metric('collexions_cycle_duration_seconds', 'gauge', "Wall time of the last cycle.", [({}, last['duration'])])
+            phases = sorted(last['phases'].items())
+            metric('collexions_phase_seconds', 'gauge', "Time spent per phase in the last cycle, summed over workers.",
+                   [(dict(phase=p, server=sv, library=l), s[0]) for (p, sv, l), s in phases])
+            metric('collexions_phase_calls', 'gauge', "Calls per phase in the last cycle.", [(dict(phase=p, server=sv, library=l), s[1]) for (p, sv, l), s in phases])
+            metric('collexions_phase_errors', 'gauge', "Errors per phase in the last cycle.", [(dict(phase=p, server=sv, library=l), s[2]) for (p, sv, l), s in phases])
+            requests_ = sorted(last['requests'].items())
+            metric('collexions_plex_requests', 'gauge', "Plex HTTP requests per endpoint in the last cycle.", [(dict(server=sv, method=m, endpoint=e), s[0]) for (sv, m, e), s in requests_])
+            metric('collexions_plex_request_seconds', 'gauge', "Total Plex request latency per endpoint in the last cycle.", [(dict(server=sv, method=m, endpoint=e), s[1]) for (sv, m, e), s in requests_])
+            metric('collexions_plex_request_max_seconds', 'gauge', "Slowest Plex request per endpoint in the last cycle.", [(dict(server=sv, method=m, endpoint=e), s[2]) for (sv, m, e), s in requests_])
+            metric('collexions_plex_requests_total', 'counter', "Plex HTTP requests since start.",
+                   [(dict(server=sv, method=m, endpoint=e, status=st), n) for (sv, m, e, st), n in sorted(self.requests_total.items())])
+            metric('collexions_collections', 'gauge', "Collections per library and state in the last cycle.",
+                   [(dict(server=sv, library=l, state=st), v) for (sv, l, st), v in sorted(last['counts'].items())])
+        return '\n'.join(lines) + '\n'
+
+_metrics = CycleMetrics()
+
+def get_metrics():
+    """Returns the process-wide cycle metrics."""
+    return _metrics
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urlsplit(self.path).path not in ('/', '/metrics'): self.send_error(404); return
+        body = get_metrics().render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+_metrics_server = None
+
+def start_metrics_server(port):
+    """Serves /metrics on port (restarting on a port change); a falsy port stops the server."""
+    global _metrics_server
+    if _metrics_server is not None and _metrics_server.server_port == port: return
+    if _metrics_server is not None: _metrics_server.shutdown(); _metrics_server.server_close(); _metrics_server = None
+    if not port: return
+    if not isinstance(port, int) or not 0 < port < 65536: logging.warning(f"Invalid 'metrics_port': {port}. Metrics endpoint disabled."); return
+    try:
+        _metrics_server = ThreadingHTTPServer(('', port), _MetricsHandler)
+        _metrics_server.daemon_threads = True
+        threading.Thread(target=_metrics_server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f"Serving Prometheus metrics on port {port} (/metrics).")
+    except OSError as e: logging.error(f"Could not start metrics endpoint on port {port}: {e}"); _metrics_server = None
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: f.write(text)
+    os.replace(tmp_path, path)
+
+def publish_cycle_metrics(config, summary):
+    """Logs the cycle summary as JSON and writes the optional metrics textfile and summary file."""
+    summary_json = json.dumps(summary, ensure_ascii=False)
+    logging.info(f"Cycle summary: {summary_json}")
+    for key, text in (('metrics_textfile', lambda: get_metrics().render_prometheus()), ('cycle_summary_file', lambda: summary_json + '\n')):
+        path = config.get(key)
+        if not path or not isinstance(path, str): continue
+        try: _write_atomic(path, text())
+        except Exception as e: logging.error(f"Error writing {key} '{path}': {e}")
 
 # --- Functions ---
 
-def load_selected_collections():
-    """Loads the history of previously pinned collections."""
-    if os.path.exists(SELECTED_COLLECTIONS_FILE):
+def load_selected_collections(path=SELECTED_COLLECTIONS_FILE):
+    """Loads the legacy selected_collections.json history (used for migration)."""
+    if os.path.exists(path):
         try:
-            with open(SELECTED_COLLECTIONS_FILE, 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 data = json.load(f);
                 if isinstance(data, dict): return data
-                else: logging.error(f"Invalid format in {SELECTED_COLLECTIONS_FILE}. Resetting."); return {}
-        except json.JSONDecodeError: logging.error(f"Error decoding {SELECTED_COLLECTIONS_FILE}. Resetting."); return {}
-        except Exception as e: logging.error(f"Error loading {SELECTED_COLLECTIONS_FILE}: {e}. Resetting."); return {}
+                else: logging.error(f"Invalid format in {path}. Resetting."); return {}
+        except json.JSONDecodeError: logging.error(f"Error decoding {path}. Resetting."); return {}
+        except Exception as e: logging.error(f"Error loading {path}: {e}. Resetting."); return {}
     return {}
 
-def save_selected_collections(selected_collections):
-    """Saves the updated history of pinned collections."""
-    try:
-        with open(SELECTED_COLLECTIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(selected_collections, f, ensure_ascii=False, indent=4)
-    except Exception as e: logging.error(f"Error saving {SELECTED_COLLECTIONS_FILE}: {e}")
-
-def get_recently_pinned_collections(selected_collections, config):
+class PinHistory:
+    """Append-only JSON-lines pin history, indexed by timestamp and by title.
+
+    Each line is {"ts": epoch, "time": "YYYY-mm-dd HH:MM:SS", "titles": [...]}. Compaction rewrites the file
+    (atomically) as one entry per distinct last-pinned time, which preserves every query this store answers.
+    """
+    def __init__(self, path=PIN_HISTORY_FILE, legacy_path=SELECTED_COLLECTIONS_FILE, read_only=False):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._lock = threading.Lock()
+        self._times = [] # sorted entry timestamps
+        self._entries = [] # titles per entry, parallel to _times
+        self.last_pinned = {} # title -> last pinned timestamp
+        self._stale_lines = 0
+        if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+            if read_only: self._load_legacy() # same history as a migration, without rewriting any file
+            else: self._migrate()
+        else: self._load()
+
+    def _add(self, ts, titles):
+        i = bisect.bisect_right(self._times, ts)
+        self._times.insert(i, ts); self._entries.insert(i, titles)
+        for t in titles:
+            if ts > self.last_pinned.get(t, float('-inf')): self.last_pinned[t] = ts
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip(): continue
+                    try:
+                        entry = json.loads(line)
+                        self._add(float(entry['ts']), [t for t in entry.get('titles', []) if isinstance(t, str)])
+                    except Exception: logging.warning(f"Skipping invalid history line {line_no} in {self.path}.")
+        except Exception as e: logging.error(f"Error loading {self.path}: {e}. Starting with empty history.")
+        # Count what earlier runs left behind, so one-append-per-process runs (--once) still reach the compaction threshold
+        retention_cutoff = time.time() - PIN_HISTORY_RETENTION_DAYS * 86400
+        self._stale_lines = len(self._times) - len({ts for ts in self.last_pinned.values() if ts >= retention_cutoff})
+
+    def _load_legacy(self):
+        """Adds the legacy selected_collections.json entries; returns how many there were."""
+        legacy = load_selected_collections(self.legacy_path)
+        for timestamp_str, titles in legacy.items():
+            if not isinstance(titles, list): continue
+            try:
+                try: timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
+                except ValueError: timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d')
+            except ValueError: logging.warning(f"Skipping invalid date format during migration: '{timestamp_str}'."); continue
+            self._add(timestamp.timestamp(), [t for t in titles if isinstance(t, str)])
+        return len(legacy)
+
+    def _migrate(self):
+        legacy_count = self._load_legacy()
+        if not self.compact(): logging.warning(f"Keeping {self.legacy_path}; migration will be retried on the next start."); return
+        try: os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
+        except OSError as e: logging.warning(f"Could not rename {self.legacy_path} after migration: {e}")
+        logging.info(f"Migrated {legacy_count} history entries from {self.legacy_path} to {self.path}.")
+
+    def pinned_since(self, cutoff):
+        """Returns the set of titles pinned at or after the cutoff (epoch seconds)."""
+        with self._lock:
+            i = bisect.bisect_left(self._times, cutoff)
+            return {t for titles in self._entries[i:] for t in titles}
+
+    def record(self, titles, when=None):
+        """Appends one history entry for the given titles."""
+        titles = sorted(set(t for t in titles if isinstance(t, str)))
+        if not titles: return
+        ts = when if when is not None else time.time()
+        line = json.dumps({'ts': ts, 'time': datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), 'titles': titles}, ensure_ascii=False)
+        with self._lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f: f.write(line + '\n'); f.flush(); os.fsync(f.fileno())
+            except Exception as e: logging.error(f"Error saving {self.path}: {e}")
+            self._add(ts, titles)
+            self._stale_lines += 1
+            compact = self._stale_lines >= PIN_HISTORY_COMPACT_EVERY
+        if compact: self.compact()
+
+    def compact(self):
+        """Rewrites the log as one entry per distinct last-pinned time, dropping titles past the retention window. Returns True on success."""
+        with self._lock:
+            retention_cutoff = time.time() - PIN_HISTORY_RETENTION_DAYS * 86400
+            grouped = {}
+            for title, ts in self.last_pinned.items():
+                if ts >= retention_cutoff: grouped.setdefault(ts, []).append(title)
+            self._times, self._entries, self.last_pinned = [], [], {}
+            for ts in sorted(grouped): self._add(ts, sorted(grouped[ts]))
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for ts, titles in zip(self._times, self._entries):
+                        f.write(json.dumps({'ts': ts, 'time': datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), 'titles': titles}, ensure_ascii=False) + '\n')
+                    f.flush(); os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception as e: logging.error(f"Error compacting {self.path}: {e}"); return False
+            finally: self._stale_lines = 0
+            return True
+
+def get_recently_pinned_collections(history, config):
     """Gets titles of non-special collections pinned within the repeat_block_hours window."""
     repeat_block_hours = config.get('repeat_block_hours', 12)
     if not isinstance(repeat_block_hours, (int, float)) or repeat_block_hours <= 0:
         logging.warning(f"Invalid 'repeat_block_hours', defaulting 12."); repeat_block_hours = 12
     cutoff_time = datetime.now() - timedelta(hours=repeat_block_hours)
-    recent_titles = set()
-    timestamps_to_keep = {}
     logging.info(f"Checking history since {cutoff_time.strftime('%Y-%m-%d %H:%M:%S')} for recently pinned non-special items")
-    for timestamp_str, titles in list(selected_collections.items()):
-        if not isinstance(titles, list): logging.warning(f"Cleaning invalid history: {timestamp_str}"); selected_collections.pop(timestamp_str, None); continue
-        try:
-            try: timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            except ValueError: timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d')
-            if timestamp >= cutoff_time:
-                valid_titles = {t for t in titles if isinstance(t, str)}; recent_titles.update(valid_titles)
-                timestamps_to_keep[timestamp_str] = titles
-        except ValueError: logging.warning(f"Cleaning invalid date format: '{timestamp_str}'."); selected_collections.pop(timestamp_str, None)
-        except Exception as e: logging.error(f"Cleaning problematic history '{timestamp_str}': {e}."); selected_collections.pop(timestamp_str, None)
-
-    keys_to_remove = set(selected_collections.keys()) - set(timestamps_to_keep.keys())
-    if keys_to_remove:
-         logging.info(f"Removing {len(keys_to_remove)} old entries from history file.")
-         for key in keys_to_remove: selected_collections.pop(key, None)
-         save_selected_collections(selected_collections)
-
+    recent_titles = history.pinned_since(cutoff_time.timestamp())
     if recent_titles:
-        logging.info(f"Recently pinned non-special collections (excluded): {', '.join(sorted(list(recent_titles)))}")
+        logging.info(f"{len(recent_titles)} recently pinned non-special collection(s) will be excluded.")
+        if logging.getLogger().isEnabledFor(logging.DEBUG): logging.debug(f"Recently pinned non-special collections: {', '.join(sorted(recent_titles))}")
     return recent_titles
 
-def is_regex_excluded(title, patterns):
-    """Checks if a title matches any regex pattern."""
-    if not patterns or not isinstance(patterns, list): return False
-    try:
-        for pattern in patterns:
+def _updated_epoch(collection):
+    updated = getattr(collection, 'updatedAt', None)
+    return updated if isinstance(updated, (int, float)) else _epoch(updated)
+
+def get_rotation_weight(config):
+    """Returns the weight function for the optional 'rotation_weight' setting ('item_count' or 'recently_updated'), or None."""
+    mode = config.get('rotation_weight')
+    if mode is None: return None
+    if mode == 'item_count': return lambda c: max(getattr(c, 'childCount', 0) or 0, 1)
+    if mode == 'recently_updated':
+        now = time.time()
+        return lambda c: 1 + 9 * 0.5 ** (max(now - _updated_epoch(c), 0) / (RECENTLY_UPDATED_HALF_LIFE_DAYS * 86400))
+    logging.warning(f"Invalid 'rotation_weight': {mode}. Using an unweighted shuffle."); return None
+
+def weighted_shuffle(items, weight=None):
+    """Random order in which heavier items tend to come first (one random key per item, Efraimidis-Spirakis)."""
+    items = list(items)
+    if weight is None: random.shuffle(items); return items
+    return sorted(items, key=lambda item: random.random() ** (1.0 / weight(item)), reverse=True)
+
+def _insert_randomly(deck, titles):
+    """Returns deck with titles inserted at random positions, in one pass."""
+    positions = sorted((random.randint(0, len(deck)), i) for i in range(len(titles)))
+    merged, start = [], 0
+    for pos, i in positions: merged.extend(deck[start:pos]); merged.append(titles[i]); start = pos
+    merged.extend(deck[start:])
+    return merged
+
+class RotationDeck:
+    """Persistent per-library shuffled deck of eligible titles that random picks are dealt from.
+
+    Every eligible collection is dealt once per pass before the deck is reshuffled, so none is left out for months
+    (repeat_block_hours still applies on top). Titles that appear during a pass are shuffled into the rest of it,
+    titles that disappear are dropped when they reach the top. The top of the deck is the end of 'remaining'.
+    """
+    def __init__(self, path=ROTATION_DECK_FILE):
+        self.path = path
+        self.libraries = {} # library name -> {'pass': n, 'remaining': [titles], 'dealt': {titles}}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Loads the deck file, starting with fresh decks if it is missing, invalid or from another version."""
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+            if not isinstance(data, dict) or data.get('version') != ROTATION_DECK_VERSION: raise ValueError("unsupported format")
+            for name, entry in data.get('libraries', {}).items():
+                self.libraries[name] = {'pass': int(entry.get('pass', 1)), 'remaining': list(entry.get('remaining', [])), 'dealt': set(entry.get('dealt', []))}
+        except Exception as e: logging.warning(f"Ignoring rotation deck {self.path}: {e}"); self.libraries = {}
+
+    def save(self):
+        """Atomically writes the decks if they changed since the last save."""
+        with self._lock:
+            if not self._dirty: return
+            data = {'version': ROTATION_DECK_VERSION, 'libraries': {
+                name: {'pass': entry['pass'], 'remaining': entry['remaining'], 'dealt': sorted(entry['dealt'])} for name, entry in self.libraries.items()}}
+            self._dirty = False
+        try: _write_atomic(self.path, json.dumps(data, ensure_ascii=False))
+        except Exception as e: logging.error(f"Error saving {self.path}: {e}")
+
+    def _start_pass(self, library_name, index, weight, dealt):
+        # Called with the lock held
+        entry = {'pass': self.libraries.get(library_name, {}).get('pass', 0) + 1, 'dealt': set(dealt)}
+        entry['remaining'] = [c.title for c in weighted_shuffle((c for t, c in index.eligible.items() if t not in dealt), weight)][::-1]
+        self.libraries[library_name] = entry
+        logging.info(f"Rotation deck for '{library_name}': starting pass {entry['pass']} with {len(entry['remaining'])} collections.")
+        return entry
+
+    def deal(self, library_name, index, count, exclude_titles=(), weight=None):
+        """Returns up to count eligible collections from the top of the library's deck (not in exclude_titles)."""
+        with self._lock:
+            entry = self.libraries.get(library_name)
+            if entry is None: entry = self._start_pass(library_name, index, weight, ())
+            else:
+                queued = set(entry['remaining'])
+                new = [t for t in index.eligible if t not in queued and t not in entry['dealt']]
+                if new: entry['remaining'] = _insert_randomly(entry['remaining'], new); logging.info(f"Rotation deck for '{library_name}': added {len(new)} new collection(s).")
+            picks, held, refilled = [], [], False
+            while len(picks) < count:
+                if not entry['remaining']:
+                    if refilled: break # fewer eligible collections than slots
+                    entry = self._start_pass(library_name, index, weight, {c.title for c in picks}); held = []; refilled = True
+                    continue
+                title = entry['remaining'].pop()
+                if title in entry['dealt'] or title not in index.by_title: continue # pinned already this pass, or gone
+                if title in exclude_titles or title not in index.eligible: held.append(title); continue # keep its place
+                picks.append(index.eligible[title]); entry['dealt'].add(title)
+            entry['remaining'].extend(reversed(held))
+            self._dirty = True
+        logging.info(f"Rotation deck for '{library_name}': pass {entry['pass']}, {len(entry['remaining'])} collection(s) left.")
+        return picks
+
+    def mark_dealt(self, library_name, titles):
+        """Counts collections pinned outside the deck (specials, categories) as dealt for the current pass."""
+        with self._lock:
+            entry = self.libraries.get(library_name)
+            if entry is None: return
+            new = set(titles) - entry['dealt']
+            if new: entry['dealt'].update(new); self._dirty = True
+
+class RegexExclusionMatcher:
+    """Validated, precompiled regex_exclusion_patterns with per-title verdicts cached across cycles."""
+    _UNSAFE_TO_MERGE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)')
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns) if isinstance(patterns, list) else ()
+        self.invalid = []
+        self._compiled = [] # [(pattern, compiled)]
+        for pattern in self.patterns:
             if not isinstance(pattern, str) or not pattern: continue
-            if re.search(pattern, title, re.IGNORECASE): logging.info(f"Excluding '{title}' (regex: '{pattern}')"); return True
-    except re.error as e: logging.error(f"Invalid regex '{pattern}': {e}"); return False
-    except Exception as e: logging.error(f"Regex error for '{title}', pattern '{pattern}': {e}"); return False
-    return False
+            try: self._compiled.append((pattern, re.compile(pattern, re.IGNORECASE)))
+            except re.error as e: self.invalid.append(pattern); logging.error(f"Invalid regex '{pattern}': {e}. Ignoring it.")
+        self._combined = None
+        if len(self._compiled) > 1 and not any(self._UNSAFE_TO_MERGE.search(p) for p, _ in self._compiled):
+            try: self._combined = re.compile('|'.join(f'(?P<_rx{i}>{p})' for i, (p, _) in enumerate(self._compiled)), re.IGNORECASE)
+            except re.error: self._combined = None # e.g. duplicate group names; match pattern by pattern
+        self._verdicts = {}
+        if self._compiled:
+            logging.info(f"Loaded {len(self._compiled)} regex exclusion pattern(s){' (combined)' if self._combined else ''}; {len(self.invalid)} invalid.")
+
+    def match(self, title):
+        """Returns the first pattern matching the title, or None. Verdicts are memoized per title."""
+        if not self._compiled or not isinstance(title, str): return None
+        try: return self._verdicts[title]
+        except KeyError: pass
+        matched = None
+        if self._combined is not None:
+            m = self._combined.search(title)
+            if m: matched = next(self._compiled[int(name[3:])][0] for name, value in m.groupdict().items() if name.startswith('_rx') and value is not None)
+        else:
+            matched = next((p for p, rx in self._compiled if rx.search(title)), None)
+        self._verdicts[title] = matched
+        return matched
+
+_regex_matcher = None
+_regex_matcher_lock = threading.Lock()
+
+def get_regex_matcher(patterns):
+    """Returns the shared matcher, rebuilding it (and dropping cached verdicts) only when the patterns change."""
+    global _regex_matcher
+    key = tuple(patterns) if isinstance(patterns, list) else ()
+    with _regex_matcher_lock:
+        if _regex_matcher is None or _regex_matcher.patterns != key: _regex_matcher = RegexExclusionMatcher(patterns)
+        return _regex_matcher
+
+class SpecialWindowIndex:
+    """special_collections windows compiled into sorted day-of-year segments; lookups are a single bisect.
+
+    Days are ordinals in a leap year so 02-29 is valid; windows wrapping the new year (e.g. 12-26 -> 01-03) are split.
+    """
+    def __init__(self, special_configs):
+        self.windows = [] # [((start_month, start_day), (end_month, end_day), names)]
+        if not isinstance(special_configs, list):
+            if special_configs: logging.warning("'special_collections' not list.")
+            special_configs = []
+        for special in special_configs:
+            if not isinstance(special, dict) or not all(k in special for k in ['start_date', 'end_date', 'collection_names']):
+                logging.warning(f"Skipping invalid entry in special_collections: {special}"); continue
+            s_date, e_date, names = special.get('start_date'), special.get('end_date'), special.get('collection_names')
+            if not isinstance(names, list) or not s_date or not e_date: logging.warning(f"Skipping invalid entry in special_collections: {special}"); continue
+            try: start, end = self._parse(s_date), self._parse(e_date)
+            except ValueError: logging.error(f"Invalid date format in special: {special}. Use MM-DD."); continue
+            self.windows.append((start, end, tuple(n for n in names if isinstance(n, str))))
+        self.all_names = frozenset(n for _, _, names in self.windows for n in names)
+
+        # Elementary segments: _starts[i] is the first day of a segment whose active titles are _titles[i]
+        intervals = []
+        for start, end, names in self.windows:
+            s_ord, e_ord = self._ordinal(*start), self._ordinal(*end)
+            if s_ord <= e_ord: intervals.append((s_ord, e_ord, names))
+            else: intervals.extend([(s_ord, 366, names), (1, e_ord, names)])
+        points = sorted({1} | {s for s, _, _ in intervals} | {e + 1 for _, e, _ in intervals if e < 366})
+        self._starts = points
+        self._titles = [frozenset(n for s, e, names in intervals if s <= p <= e for n in names) for p in points]
+
+    @staticmethod
+    def _parse(value):
+        month, day = (int(p) for p in str(value).split('-'))
+        date(2000, month, day) # validates (2000 is a leap year)
+        return month, day
+
+    @staticmethod
+    def _ordinal(month, day):
+        return date(2000, month, day).timetuple().tm_yday
+
+    def active_on(self, day):
+        """Returns the frozenset of special titles active on the given date."""
+        if not self.windows: return frozenset()
+        return self._titles[bisect.bisect_right(self._starts, self._ordinal(day.month, day.day)) - 1]
+
+    def next_boundary(self, now):
+        """Returns the earliest datetime after now at which a window starts or ends (day after its end date), or None."""
+        boundaries = []
+        for start, end, _ in self.windows:
+            for (month, day), day_offset in ((start, 0), (end, 1)):
+                for year in (now.year, now.year + 1):
+                    try: boundary = datetime(year, month, day) + timedelta(days=day_offset)
+                    except ValueError: continue # 02-29 in a non-leap year
+                    if boundary > now: boundaries.append(boundary); break
+        return min(boundaries, default=None)
+
+class CompiledConfig(dict):
+    """config.json contents, validated once, with derived sets and indexes precomputed."""
+    def __init__(self, data, fingerprint=None):
+        super().__init__(data)
+        self.fingerprint = fingerprint
+        if 'collexions_label' not in self or not isinstance(self['collexions_label'], str) or not self['collexions_label']:
+            logging.warning("Missing or invalid 'collexions_label' in config. Defaulting to 'Pinned by Collexions'.")
+            self['collexions_label'] = 'Pinned by Collexions'
+        exclusion_raw = self.get('exclusion_list', [])
+        self.exclusion_set = frozenset(n for n in exclusion_raw if isinstance(n, str)) if isinstance(exclusion_raw, list) else frozenset()
+        self.special_index = SpecialWindowIndex(self.get('special_collections', []))
+        self.all_special_names = self.special_index.all_names
+        self.category_sets = {}
+        categories = self.get('categories', {})
+        for library_name, cat_conf in (categories.items() if isinstance(categories, dict) else []):
+            if not isinstance(cat_conf, dict): continue
+            # Unique names in config order, so category candidates stay deterministic
+            self.category_sets[library_name] = {c: tuple(dict.fromkeys(n for n in names if isinstance(n, str))) for c, names in cat_conf.items() if c != 'always_call' and isinstance(names, list)}
+        self.regex_matcher = get_regex_matcher(self.get('regex_exclusion_patterns', []))
+        # Multi-server mode: each "servers" entry overrides the top-level settings for one Plex server
+        self.servers = []
+        servers_raw = self.get('servers')
+        if servers_raw is not None and not isinstance(servers_raw, list): logging.error("'servers' must be a list. Ignoring it.")
+        elif servers_raw:
+            shared = {k: v for k, v in self.items() if k != 'servers'}
+            for i, entry in enumerate(servers_raw, 1):
+                if not isinstance(entry, dict): logging.error(f"Skipping invalid 'servers' entry #{i}."); continue
+                name = entry.get('name') if isinstance(entry.get('name'), str) and entry.get('name').strip() else f"server{i}"
+                # Names are compared as they appear in the per-server state file names, so two servers never share files
+                clash = next((n for n, _ in self.servers if _server_file_tag(n) == _server_file_tag(name)), None)
+                if clash == name: logging.error(f"Skipping duplicate server name '{name}'."); continue
+                if clash is not None: logging.error(f"Skipping server '{name}': its name clashes with '{clash}' (same state file names)."); continue
+                self.servers.append((name, CompiledConfig({**shared, **entry, 'name': name}, fingerprint)))
+
+    def server_configs(self):
+        """Returns [(server name, config)] to run; [(None, self)] in single-server mode."""
+        return self.servers or [(None, self)]
+
+_config_cache = {'stat': None, 'config': None}
 
 def load_config():
-    """Loads configuration from config.json, exits on critical errors."""
-    if os.path.exists(CONFIG_PATH):
-        try:
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config_data = json.load(f)
-                if not isinstance(config_data, dict): raise ValueError("Config not JSON object.")
-                # --- Add validation/default for the new label ---
-                if 'collexions_label' not in config_data or not isinstance(config_data['collexions_label'], str) or not config_data['collexions_label']:
-                    logging.warning("Missing or invalid 'collexions_label' in config. Defaulting to 'Pinned by Collexions'.")
-                    config_data['collexions_label'] = 'Pinned by Collexions'
-                # --- End validation ---
-                return config_data
-        except Exception as e: logging.critical(f"CRITICAL: Error load/parse {CONFIG_PATH}: {e}. Exit."); sys.exit(1)
-    else: logging.critical(f"CRITICAL: Config not found {CONFIG_PATH}. Exit."); sys.exit(1)
+    """Loads configuration from config.json, recompiling only when the file changed; exits on critical errors."""
+    try: stat = os.stat(CONFIG_PATH)
+    except FileNotFoundError: logging.critical(f"CRITICAL: Config not found {CONFIG_PATH}. Exit."); sys.exit(1)
+    cached = _config_cache['config']
+    stat_key = (stat.st_mtime_ns, stat.st_size)
+    if cached is not None and _config_cache['stat'] == stat_key: return cached
+    try:
+        with open(CONFIG_PATH, 'rb') as f: raw = f.read()
+        fingerprint = hashlib.sha256(raw).hexdigest()
+        if cached is not None and cached.fingerprint == fingerprint: # touched but unchanged
+            _config_cache['stat'] = stat_key; return cached
+        config_data = json.loads(raw.decode('utf-8'))
+        if not isinstance(config_data, dict): raise ValueError("Config not JSON object.")
+        config = CompiledConfig(config_data, fingerprint)
+    except Exception as e:
+        if cached is None: logging.critical(f"CRITICAL: Error load/parse {CONFIG_PATH}: {e}. Exit."); sys.exit(1)
+        logging.error(f"Error load/parse {CONFIG_PATH}: {e}. Keeping the previous configuration.")
+        _config_cache['stat'] = stat_key; return cached
+    if cached is not None: logging.info(f"{CONFIG_PATH} changed. Configuration reloaded.")
+    _config_cache['stat'] = stat_key; _config_cache['config'] = config
+    return config
+
+def compile_config(config):
+    """Returns config as a CompiledConfig (compiling plain dicts on the fly)."""
+    return config if isinstance(config, CompiledConfig) else CompiledConfig(config)
 
 def connect_to_plex(config):
     """Connects to Plex server, returns PlexServer object or None."""
@@ -118,396 +780,1198 @@ def connect_to_plex(config):
         plex_url, plex_token = config.get('plex_url'), config.get('plex_token')
         if not isinstance(plex_url, str) or not plex_url or not isinstance(plex_token, str) or not plex_token:
             raise ValueError("Missing/invalid 'plex_url'/'plex_token'")
-        plex = PlexServer(plex_url, plex_token, timeout=60)
+        _, max_requests = get_concurrency_limits(config)
+        import_plex_modules()
+        plex = PlexServer(plex_url, plex_token, session=BoundedSession(max_requests), timeout=60)
         logging.info(f"Connected to Plex server '{plex.friendlyName}' successfully.")
         return plex
     except ValueError as e: logging.error(f"Config error for Plex: {e}"); return None
     except Exception as e: logging.error(f"Failed to connect to Plex: {e}"); return None
 
-def get_collections_from_all_libraries(plex, library_names):
-    """Fetches all collection objects from the specified library names."""
+class PlexConnectionManager:
+    """Keeps one PlexServer (and its pooled session) alive across cycles, reconnecting with backoff on failure."""
+    def __init__(self, base_delay=RECONNECT_BASE_DELAY):
+        self.plex = None
+        self.base_delay = base_delay
+        self.failures = 0
+        self._settings = None
+
+    def get(self, config):
+        """Returns a healthy PlexServer, reusing the current one when possible; None if connecting failed."""
+        settings = (config.get('plex_url'), config.get('plex_token'), get_concurrency_limits(config)[1])
+        if self.plex is not None and settings != self._settings:
+            logging.info("Plex connection settings changed. Reconnecting."); self.close()
+        if self.plex is not None:
+            try:
+                # Cheap health check; also drops the cached section list so new/renamed libraries are picked up
+                self.plex.library.reload()
+                return self.plex
+            except Exception as e: logging.warning(f"Plex health check failed ({e}). Reconnecting."); self.close()
+
+        self.plex = connect_to_plex(config)
+        if self.plex: self._settings = settings; self.failures = 0
+        else: self.failures += 1
+        return self.plex
+
+    def retry_delay(self, max_delay):
+        """Seconds to wait before the next connection attempt: exponential backoff with jitter, capped at max_delay."""
+        delay = min(max_delay, self.base_delay * (2 ** max(self.failures - 1, 0)))
+        return random.uniform(delay / 2, delay)
+
+    def close(self):
+        """Drops the current connection and closes its session."""
+        if self.plex is not None:
+            try: self.plex._session.close()
+            except Exception: pass
+        self.plex = None; self._settings = None
+
+# --- Collection Cache ---
+def _epoch(value):
+    """Converts a plexapi datetime (or None) to integer epoch seconds."""
+    try: return int(value.timestamp()) if value else 0
+    except Exception: return 0
+
+def _listing_labels(collection):
+    """Reads the label tags included in listing data without triggering a per-item reload."""
+    auto_reload = getattr(collection, '_autoReload', True)
+    collection._autoReload = False
+    try: return sorted(l.tag for l in (collection.labels or []) if getattr(l, 'tag', None))
+    except Exception: return []
+    finally: collection._autoReload = auto_reload
+
+class CollectionRecord:
+    """Cached collection metadata; exposes the attributes the selector reads from plexapi collections."""
+    __slots__ = ('ratingKey', 'title', 'childCount', 'labels', 'updatedAt', 'promoted', 'librarySectionID')
+    type = 'collection' # as on plexapi collections, so records can be passed to section multi-edits
+
+    def __init__(self, ratingKey, title, childCount=0, labels=None, updatedAt=0, promoted=False, librarySectionID=None):
+        self.ratingKey = ratingKey; self.title = title; self.childCount = childCount
+        self.labels = list(labels or []); self.updatedAt = updatedAt; self.promoted = promoted
+        self.librarySectionID = librarySectionID
+
+    @classmethod
+    def from_collection(cls, collection, promoted=False):
+        return cls(collection.ratingKey, collection.title, collection.childCount or 0, _listing_labels(collection),
+                   _epoch(collection.updatedAt), promoted, collection.librarySectionID)
+
+    def to_dict(self):
+        return {'title': self.title, 'childCount': self.childCount, 'labels': self.labels, 'updatedAt': self.updatedAt, 'promoted': self.promoted}
+
+    def __repr__(self):
+        return f"<CollectionRecord {self.ratingKey} '{self.title}'>"
+
+def get_server_filters(config):
+    """Listing filters Plex applies server-side: the min_items_for_pinning threshold as childCount>>."""
+    min_items = config.get('min_items_for_pinning', 10)
+    if isinstance(min_items, int) and not isinstance(min_items, bool) and min_items > 0: return {'childCount>>': min_items - 1}
+    return {}
+
+def iter_library_collections(library, params=None, page_size=COLLECTION_PAGE_SIZE):
+    """Yields a library's collections one container page at a time, so only a page of objects is held in memory."""
+    key = f'/library/sections/{library.key}/all'
+    params = {'type': 18, 'excludeFields': COLLECTION_LISTING_EXCLUDED_FIELDS, **(params or {})}
+    start = 0
+    while True:
+        page = library.fetchItems(key, container_start=start, container_size=page_size, maxresults=page_size, params=params)
+        yield from page
+        if len(page) < page_size: return
+        start += page_size
+
+class CollectionCache:
+    """Persistent per-library collection metadata, refreshed incrementally from updatedAt timestamps."""
+    def __init__(self, path=COLLECTION_CACHE_FILE):
+        self.path = path
+        self.libraries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Loads the cache file, starting empty if it is missing, invalid or from another version."""
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+            if not isinstance(data, dict) or data.get('version') != COLLECTION_CACHE_VERSION: raise ValueError("unsupported format")
+            for name, entry in data.get('libraries', {}).items():
+                sid = entry.get('section_key')
+                entry['collections'] = {int(k): CollectionRecord(int(k), librarySectionID=sid, **v) for k, v in entry.get('collections', {}).items()}
+                self.libraries[name] = entry
+        except Exception as e: logging.warning(f"Ignoring collection cache {self.path}: {e}"); self.libraries = {}
+
+    def save(self):
+        """Atomically writes the cache if it changed since the last save."""
+        with self._lock:
+            if not self._dirty: return
+            data = {'version': COLLECTION_CACHE_VERSION, 'libraries': {
+                name: {**{k: v for k, v in entry.items() if k != 'collections'},
+                       'collections': {str(rk): r.to_dict() for rk, r in entry['collections'].items()}}
+                for name, entry in self.libraries.items()}}
+            self._dirty = False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e: logging.error(f"Error saving {self.path}: {e}")
+
+    def refresh(self, library, filters=None):
+        """Brings the library's records up to date and returns them; only changed collections are downloaded.
+
+        filters (see get_server_filters) are applied by Plex on full refreshes; the cache only holds matching collections.
+        """
+        filters = dict(filters or {})
+        section_updated = _epoch(getattr(library, 'updatedAt', None))
+        now = time.time()
+        with self._lock: entry = self.libraries.get(library.title)
+        full = (entry is None or entry.get('section_key') != library.key or entry.get('section_updated_at') != section_updated
+                or entry.get('filters') != filters or now - entry.get('refreshed_at', 0) > COLLECTION_CACHE_FULL_REFRESH_HOURS * 3600)
+        if full:
+            old_records = entry['collections'] if entry else {}
+            records = {}
+            for c in iter_library_collections(library, filters):
+                old = old_records.get(c.ratingKey) # keep known promoted state across full refreshes
+                records[c.ratingKey] = CollectionRecord.from_collection(c, promoted=old.promoted if old else False)
+            entry = {'section_key': library.key, 'section_updated_at': section_updated, 'refreshed_at': now, 'filters': filters, 'collections': records}
+            logging.info(f"Collection cache: full refresh of '{library.title}' ({len(records)} collections).")
+        else:
+            # Unfiltered, so collections that dropped below the threshold are seen (and dropped) too
+            cursor = max((r.updatedAt for r in entry['collections'].values()), default=0)
+            min_count = filters.get('childCount>>')
+            changed = 0
+            for c in iter_library_collections(library, {'updatedAt>>': cursor}):
+                changed += 1
+                old = entry['collections'].pop(c.ratingKey, None)
+                record = CollectionRecord.from_collection(c, promoted=old.promoted if old else False)
+                if min_count is None or record.childCount > min_count: entry['collections'][c.ratingKey] = record
+            logging.info(f"Collection cache: incremental refresh of '{library.title}' ({changed} changed collection(s)).")
+        with self._lock:
+            self.libraries[library.title] = entry
+            self._dirty = True
+            return list(entry['collections'].values())
+
+    def set_promoted(self, library_name, promoted_keys):
+        """Records which collections in a library are currently promoted."""
+        with self._lock:
+            entry = self.libraries.get(library_name)
+            if not entry: return
+            promoted_keys = set(promoted_keys)
+            for rk, record in entry['collections'].items():
+                if record.promoted != (rk in promoted_keys): record.promoted = rk in promoted_keys; self._dirty = True
+
+    def update_labels(self, library_name, rating_keys, label, add):
+        """Applies a label change made by this script to the cached records."""
+        with self._lock:
+            entry = self.libraries.get(library_name)
+            if not entry: return
+            for rk in rating_keys:
+                record = entry['collections'].get(rk)
+                if record is None: continue
+                if add and label not in record.labels: record.labels.append(label)
+                elif not add and label in record.labels: record.labels.remove(label)
+                self._dirty = True
+
+    def forget(self, library_name, rating_keys):
+        """Drops records for collections that no longer exist on the server."""
+        with self._lock:
+            entry = self.libraries.get(library_name)
+            if not entry: return
+            for rk in rating_keys:
+                if entry['collections'].pop(rk, None) is not None: self._dirty = True
+
+def resolve_collections(plex, records):
+    """Returns plexapi collection objects for cached records (one batched request); passes real objects through."""
+    keys = [r.ratingKey for r in records if isinstance(r, CollectionRecord)]
+    if not keys: return list(records)
+    fetched = {c.ratingKey: c for c in plex.fetchItems(keys)}
+    resolved = []
+    for r in records:
+        if not isinstance(r, CollectionRecord): resolved.append(r)
+        elif r.ratingKey in fetched: resolved.append(fetched[r.ratingKey])
+        else: logging.warning(f"Collection '{r.title}' no longer exists on the server. Skipping.")
+    return resolved
+
+def get_collections_from_all_libraries(plex, library_names, executor=None, cache=None, filters=None, raise_errors=False):
+    """Fetches all collections from the specified library names (as cached records when a cache is given).
+
+    A library that cannot be listed is logged and skipped, or with raise_errors its error is raised, so callers can
+    tell a failed listing from an empty library.
+    """
     all_collections = []
     if not plex or not library_names: return all_collections
-    for library_name in library_names:
-        if not isinstance(library_name, str): logging.warning(f"Invalid lib name: {library_name}"); continue
-        try:
+
+    def fetch(library_name):
+        if not isinstance(library_name, str): logging.warning(f"Invalid lib name: {library_name}"); return []
+        with get_metrics().phase('fetch', library_name):
             library = plex.library.section(library_name)
-            collections_in_library = library.collections()
-            logging.info(f"Found {len(collections_in_library)} collections in '{library_name}'.")
-            all_collections.extend(collections_in_library)
-        except NotFound: logging.error(f"Library '{library_name}' not found.")
-        except Exception as e: logging.error(f"Error fetching from '{library_name}': {e}")
+            if cache is not None: collections_in_library = cache.refresh(library, filters)
+            else: collections_in_library = list(iter_library_collections(library, filters))
+        threshold = f" with more than {filters['childCount>>']} items" if filters and 'childCount>>' in filters else ""
+        logging.info(f"Found {len(collections_in_library)} collections{threshold} in '{library_name}'.")
+        return collections_in_library
+
+    for library_name, collections_in_library, error in map_ordered(executor, fetch, library_names):
+        if error and raise_errors: raise error
+        if isinstance(error, NotFound): logging.error(f"Library '{library_name}' not found.")
+        elif error: logging.error(f"Error fetching from '{library_name}': {error}")
+        else: all_collections.extend(collections_in_library)
     return all_collections
 
-def pin_collections(collections, config):
-    """Pins the provided list of collections, adds label, and sends individual Discord notifications."""
+def pin_collections(collections, config, executor=None, library_name=None):
+    """Pins the provided list of collections and queues one batched Discord notification; returns the pinned collections."""
     if not collections:
         logging.info("Pin list is empty.")
-        return
+        return []
     webhook_url = config.get('discord_webhook_url')
-    label_to_add = config.get('collexions_label') # Get label from config
 
-    for collection in collections:
+    def pin_one(collection):
         coll_title = getattr(collection, 'title', 'Untitled')
         try:
             if not hasattr(collection, 'visibility'):
                 logging.warning(f"Skip invalid collection object: '{coll_title}'.")
-                continue
+                return
 
             try: item_count = collection.childCount
             except Exception as e: logging.warning(f"Could not get item count for '{coll_title}': {e}"); item_count = "Unknown"
 
             logging.info(f"Attempting to pin: '{coll_title}'")
-            hub = collection.visibility()
-            hub.promoteHome(); hub.promoteShared()
+            with get_metrics().phase('pin', library_name):
+                hub = collection.visibility()
+                hub.promoteHome(); hub.promoteShared()
 
             log_message = f"INFO - Collection '{coll_title} - {item_count} Items' pinned successfully."
-            discord_message = f"INFO - Collection '**{coll_title} - {item_count} Items**' pinned successfully."
+            discord_message = f"Collection '**{coll_title} - {item_count} Items**' pinned successfully."
 
             logging.info(log_message)
-
-            # --- Add Label ---
-            if label_to_add:
-                try:
-                    collection.addLabel(label_to_add)
-                    logging.info(f"Added label '{label_to_add}' to '{coll_title}'.")
-                except Exception as e:
-                    logging.error(f"Failed to add label '{label_to_add}' to '{coll_title}': {e}")
-            # --- End Add Label ---
-
-            if webhook_url: send_discord_message(webhook_url, discord_message)
+            return discord_message
 
         except Exception as e:
             logging.error(f"Error processing/pinning '{coll_title}': {e}")
 
+    pinned, discord_lines = [], []
+    for collection, message, _ in map_ordered(executor, pin_one, collections):
+        if message: pinned.append(collection); discord_lines.append(message)
+    if webhook_url and discord_lines:
+        where = (f" in '{library_name}'" if library_name else "") + (f" on '{current_server()}'" if current_server() else "")
+        get_discord_notifier().notify(webhook_url, f"INFO - Pinned {len(discord_lines)} collection(s){where}:", discord_lines)
+    return pinned
+
+def _header_seconds(response, name, default):
+    """Reads a numeric (seconds) header, falling back to default."""
+    try: return max(float(response.headers.get(name)), 0.0)
+    except (TypeError, ValueError): return default
+
 def send_discord_message(webhook_url, message):
-    """Sends a message to the specified Discord webhook URL."""
-    if not webhook_url or not isinstance(webhook_url, str): return
+    """Sends a message to the Discord webhook, honouring rate limits and retrying with backoff; returns True if sent."""
+    if not webhook_url or not isinstance(webhook_url, str): return False
     data = {"content": message}
-    try:
-        response = requests.post(webhook_url, json=data, timeout=10)
-        response.raise_for_status()
-        logging.info(f"Discord msg sent (Status: {response.status_code})")
-    except requests.exceptions.RequestException as e: logging.error(f"Failed send to Discord: {e}")
-    except Exception as e: logging.error(f"Discord message error: {e}")
-
-def unpin_collections(plex, library_names, exclusion_list, config):
-    """Unpins currently promoted collections (removing label if present), respecting exclusions."""
-    if not plex: return
-    label_to_remove = config.get('collexions_label') # Get label from config
-    logging.info(f"Starting unpin check for libraries: {library_names} (Excluding: {exclusion_list})")
-    unpinned_count = 0
-    label_removed_count = 0
-    exclusion_set = set(exclusion_list) if isinstance(exclusion_list, list) else set()
+    for attempt in range(1, DISCORD_MAX_ATTEMPTS + 1):
+        backoff = min(2 ** attempt, 60) * random.uniform(0.5, 1.0)
+        try:
+            response = get_http_session().post(webhook_url, json=data, timeout=10)
+            if response.status_code == 429:
+                delay = _header_seconds(response, 'Retry-After', backoff)
+                try: delay = float(response.json().get('retry_after', delay))
+                except Exception: pass
+                logging.warning(f"Discord rate limited. Retrying in {delay:.1f}s (attempt {attempt}/{DISCORD_MAX_ATTEMPTS}).")
+                time.sleep(delay); continue
+            if response.status_code >= 500:
+                logging.warning(f"Discord server error {response.status_code}. Retrying in {backoff:.1f}s (attempt {attempt}/{DISCORD_MAX_ATTEMPTS}).")
+                time.sleep(backoff); continue
+            response.raise_for_status()
+            logging.info(f"Discord msg sent (Status: {response.status_code})")
+            # Bucket exhausted: wait for it to reset before the next message goes out
+            if response.headers.get('X-RateLimit-Remaining') == '0': time.sleep(_header_seconds(response, 'X-RateLimit-Reset-After', 0.0))
+            return True
+        except requests.exceptions.HTTPError as e: logging.error(f"Failed send to Discord: {e}"); return False
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Failed send to Discord ({e}). Retrying in {backoff:.1f}s (attempt {attempt}/{DISCORD_MAX_ATTEMPTS}).")
+            time.sleep(backoff)
+        except Exception as e: logging.error(f"Discord message error: {e}"); return False
+    logging.error(f"Giving up on Discord message after {DISCORD_MAX_ATTEMPTS} attempts.")
+    return False
 
-    for library_name in library_names:
+def build_discord_batches(header, lines, limit=DISCORD_MESSAGE_LIMIT):
+    """Joins lines under a header into as few messages as fit Discord's content limit."""
+    batches, current = [], header
+    for line in lines:
+        line = line[:limit - len(header) - 1]
+        if len(current) + 1 + len(line) > limit: batches.append(current); current = header
+        current = f"{current}\n{line}"
+    if current != header: batches.append(current)
+    return batches
+
+class DiscordNotifier:
+    """Background queue that posts batched Discord messages so pinning never waits on the webhook."""
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self, webhook_url, header, lines):
+        """Queues the lines as one (or, past the size limit, a few) messages; returns immediately."""
+        if not webhook_url or not isinstance(webhook_url, str) or not lines: return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='discord-notifier', daemon=True)
+                self._thread.start()
+            for message in build_discord_batches(header, lines): self._queue.put((webhook_url, message))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None: return
+                with get_metrics().phase('notify'):
+                    if not send_discord_message(*item): get_metrics().error('notify')
+            finally: self._queue.task_done()
+
+    def close(self, timeout=60):
+        """Flushes queued messages (waiting up to timeout seconds) and stops the worker."""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive(): return
+            self._queue.put(None)
+            self._thread = None
+        thread.join(timeout)
+        if thread.is_alive(): logging.warning(f"Discord notifications still pending after {timeout}s; exiting without them.")
+
+_discord_notifier = DiscordNotifier()
+atexit.register(_discord_notifier.close)
+
+def get_discord_notifier():
+    """Returns the process-wide Discord notifier."""
+    return _discord_notifier
+
+def get_promoted_collection_hubs(library):
+    """Returns {ratingKey: ManagedHub} for collections promoted to Home/Shared, using one managed-hubs request."""
+    promoted = {}
+    prefix = f"custom.collection.{library.key}."
+    for hub in library.managedHubs():
+        identifier = getattr(hub, 'identifier', None) or ''
+        if not identifier.startswith(prefix): continue
+        if not (getattr(hub, 'promotedToOwnHome', False) or getattr(hub, 'promotedToSharedHome', False)): continue
+        try: promoted[int(identifier[len(prefix):])] = hub
+        except ValueError: logging.warning(f"Skipping managed hub with unexpected identifier: '{identifier}'")
+    return promoted
+
+def demote_collections(library_name, hubs, exclusion_set, executor=None):
+    """Demotes the given {ratingKey: ManagedHub} collections; returns the rating keys that were unpinned."""
+    if not hubs: return []
+
+    def demote_one(rating_key):
+        hub = hubs[rating_key]
+        coll_title = hub.title or 'Untitled' # the hub is titled after its collection, no fetch needed
+        if coll_title in exclusion_set:
+            logging.info(f"Skipping unpin for explicitly excluded: '{coll_title}'")
+            return False
+        try:
+            with get_metrics().phase('unpin', library_name): hub.updateVisibility(home=False, shared=False)
+            logging.info(f"Unpinned '{coll_title}' successfully.")
+            return True
+        except Exception as demote_error:
+            logging.error(f"Failed to demote '{coll_title}': {demote_error}")
+            return False
+
+    return [rating_key for rating_key, unpinned, _ in map_ordered(executor, demote_one, list(hubs)) if unpinned]
+
+def get_labelled_collections(library, label):
+    """Returns {ratingKey: collection} for the library's collections carrying label (label id lookup + one filtered query)."""
+    choices = library.fetchItems(f'/library/sections/{library.key}/label', cls=FilterChoice, params={'type': 18})
+    label_id = next((c.key for c in choices if (c.title or '').lower() == label.lower()), None)
+    if label_id is None: return {} # label not used in this library
+    return {c.ratingKey: c for c in library.fetchItems(f'/library/sections/{library.key}/all', params={'type': 18, 'label': label_id})}
+
+def edit_collection_labels(library, collections, label, remove=False):
+    """Adds (or removes) label on many collections of one library with a multi-edit request per LABEL_EDIT_BATCH_SIZE items."""
+    collections = list(collections)
+    edits = EditTagsMixin._tagHelper('label', [label], remove=remove) # same parameters as addLabel()/removeLabel()
+    for i in range(0, len(collections), LABEL_EDIT_BATCH_SIZE):
+        library.multiEdit(collections[i:i + LABEL_EDIT_BATCH_SIZE], **edits)
+
+def sync_collection_labels(library, label, pinned, exclusion_set):
+    """Labels the pinned collections and unlabels every other labelled one; returns (labelled keys, unlabelled keys)."""
+    library_name = library.title
+    with get_metrics().phase('fetch', library_name): labelled = get_labelled_collections(library, label)
+    pinned_keys = {c.ratingKey for c in pinned}
+    to_add = [c for c in pinned if c.ratingKey not in labelled]
+    to_remove = []
+    for rating_key, collection in labelled.items():
+        if rating_key in pinned_keys: continue
+        if collection.title in exclusion_set: logging.info(f"Skipping unlabel for explicitly excluded: '{collection.title}'"); continue
+        to_remove.append(collection)
+
+    added, removed = [], []
+    if to_add:
         try:
+            with get_metrics().phase('label', library_name): edit_collection_labels(library, to_add, label)
+            added = [c.ratingKey for c in to_add]
+            logging.info(f"Added label '{label}' to {len(to_add)} collection(s) in '{library_name}': {[c.title for c in to_add]}")
+        except Exception as e: logging.error(f"Failed to add label '{label}' in '{library_name}': {e}")
+    if to_remove:
+        try:
+            with get_metrics().phase('label', library_name): edit_collection_labels(library, to_remove, label, remove=True)
+            removed = [c.ratingKey for c in to_remove]
+            logging.info(f"Removed label '{label}' from {len(to_remove)} collection(s) in '{library_name}': {[c.title for c in to_remove]}")
+        except Exception as e: logging.error(f"Failed to remove label '{label}' in '{library_name}': {e}")
+    return added, removed
+
+def plan_rotation(promoted_hubs, collections_to_pin, exclusion_set):
+    """Diffs the next pin set against the promoted hubs; returns (to_promote, to_demote, kept)."""
+    next_by_key = {}
+    for c in collections_to_pin:
+        rating_key = getattr(c, 'ratingKey', None)
+        if rating_key is not None: next_by_key.setdefault(rating_key, c)
+    to_promote = [c for k, c in next_by_key.items() if k not in promoted_hubs]
+    kept = [c for k, c in next_by_key.items() if k in promoted_hubs]
+    to_demote = {k: h for k, h in promoted_hubs.items() if k not in next_by_key and h.title not in exclusion_set}
+    return to_promote, to_demote, kept
+
+def rotate_library_collections(plex, library_name, collections_to_pin, exclusion_set, config, executor=None, cache=None, journal=None, dry_run=False):
+    """Promotes/demotes only the collections that change in a library; returns a summary dict of titles (dry_run: planned only)."""
+    summary = {'added': [], 'removed': [], 'kept': []}
+    if journal is not None and not dry_run: journal.plan_library(library_name, collections_to_pin)
+    library = None
+    try:
+        with get_metrics().phase('fetch', library_name):
             library = plex.library.section(library_name)
-            # Fetch collections once per library
-            collections_in_library = library.collections()
-            logging.info(f"Checking {len(collections_in_library)} collections in '{library_name}' for potential unpinning.")
-
-            for collection in collections_in_library:
-                coll_title = getattr(collection, 'title', 'Untitled')
-
-                # Skip if explicitly excluded by title
-                if coll_title in exclusion_set:
-                    logging.info(f"Skipping unpin/unlabel for explicitly excluded: '{coll_title}'")
-                    continue
-
-                try:
-                    # Check promotion status
-                    hub = collection.visibility()
-                    if hub._promoted:
-                        logging.info(f"Found promoted collection: '{coll_title}'. Checking for unpin/unlabel.")
-
-                        # --- Remove Label (if it exists) ---
-                        removed_label_this_time = False
-                        if label_to_remove:
-                            try:
-                                # Check if label exists before trying to remove
-                                current_labels = [l.tag for l in collection.labels] if hasattr(collection, 'labels') else []
-                                if label_to_remove in current_labels:
-                                    collection.removeLabel(label_to_remove)
-                                    logging.info(f"Removed label '{label_to_remove}' from '{coll_title}'.")
-                                    label_removed_count += 1
-                                    removed_label_this_time = True
-                                else:
-                                    # Only log if we expected the label but didn't find it (useful for debugging)
-                                    # logging.debug(f"Label '{label_to_remove}' not found on '{coll_title}', skipping removal.")
-                                    pass
-                            except Exception as e:
-                                logging.error(f"Failed to remove label '{label_to_remove}' from '{coll_title}': {e}")
-                        # --- End Remove Label ---
-
-                        # --- Demote Collection ---
-                        try:
-                            hub.demoteHome(); hub.demoteShared()
-                            logging.info(f"Unpinned '{coll_title}' successfully.")
-                            unpinned_count += 1
-                        except Exception as demote_error:
-                            logging.error(f"Failed to demote '{coll_title}': {demote_error}")
-                            # If demotion fails, maybe re-add label if we just removed it? Optional, depends on desired behaviour.
-                            # if removed_label_this_time and label_to_remove:
-                            #    try: collection.addLabel(label_to_remove); logging.warning(f"Re-added label to '{coll_title}' due to demotion error.")
-                            #    except: pass # Best effort
-                        # --- End Demote Collection ---
-                    # else: # Optional: Log collections checked but not promoted
-                    #    logging.debug(f"Collection '{coll_title}' is not promoted, skipping unpin/unlabel.")
-
-                except Exception as vis_error:
-                    logging.error(f"Error checking visibility or processing '{coll_title}' for unpin: {vis_error}")
-
-        except NotFound: logging.error(f"Library '{library_name}' not found during unpin check.")
-        except Exception as e: logging.error(f"General error during unpin process for library '{library_name}': {e}")
-
-    logging.info(f"Unpinning check complete. Unpinned {unpinned_count} collections, removed label from {label_removed_count} collections.")
-
-
-def get_active_special_collections(config):
-    """Determines which 'special' collections are active based on current date."""
-    current_date = datetime.now().date()
-    active_titles = []
-    special_configs = config.get('special_collections', [])
-    if not isinstance(special_configs, list): logging.warning("'special_collections' not list."); return []
-    for special in special_configs:
-        if not isinstance(special, dict) or not all(k in special for k in ['start_date', 'end_date', 'collection_names']): continue
-        s_date, e_date, names = special.get('start_date'), special.get('end_date'), special.get('collection_names')
-        if not isinstance(names, list) or not s_date or not e_date: continue
+            promoted_hubs = get_promoted_collection_hubs(library)
+    except NotFound: logging.error(f"Library '{library_name}' not found during rotation."); return summary
+    except Exception as e:
+        logging.warning(f"Could not read promoted collections in '{library_name}' ({e}). Pinning without demotion.")
+        promoted_hubs = {}
+
+    to_promote, to_demote, kept = plan_rotation(promoted_hubs, collections_to_pin, exclusion_set)
+    logging.info(f"Rotation plan for '{library_name}': {len(to_promote)} to pin, {len(to_demote)} to unpin, {len(kept)} kept.")
+    if dry_run:
+        return {'added': [getattr(c, 'title', 'Untitled') for c in to_promote], 'removed': [h.title for h in to_demote.values()],
+                'kept': [getattr(c, 'title', 'Untitled') for c in kept]}
+
+    # Promote before demoting so the home screen is never briefly empty
+    if to_promote and cache is not None:
         try:
-            start = datetime.strptime(s_date, '%m-%d').replace(year=current_date.year).date()
-            end = datetime.strptime(e_date, '%m-%d').replace(year=current_date.year).date()
-            end_excl = end + timedelta(days=1)
-            is_active = (start <= current_date < end_excl) if start <= end else (start <= current_date or current_date < end_excl)
-            if is_active: active_titles.extend(n for n in names if isinstance(n, str))
-        except ValueError: logging.error(f"Invalid date format in special: {special}. Use MM-DD.")
-        except Exception as e: logging.error(f"Error process special {names}: {e}")
-    unique_active = list(set(active_titles))
+            with get_metrics().phase('fetch', library_name): resolved = resolve_collections(plex, to_promote)
+            cache.forget(library_name, {c.ratingKey for c in to_promote} - {c.ratingKey for c in resolved})
+            to_promote = resolved
+        except Exception as e: logging.error(f"Error fetching collections to pin in '{library_name}': {e}"); to_promote = []
+    pinned = pin_collections(to_promote, config, executor, library_name)
+    unpinned = demote_collections(library_name, to_demote, exclusion_set, executor)
+    if journal is not None: journal.update_library(library_name, pinned=[c.ratingKey for c in pinned], unpinned=unpinned)
+    # Whole-library label changes: one label-filtered query, then one multi-edit to add and one to remove
+    label = config.get('collexions_label')
+    labelled, unlabelled = [], []
+    if label and library is not None:
+        try: labelled, unlabelled = sync_collection_labels(library, label, pinned + kept, exclusion_set)
+        except Exception as e: logging.error(f"Error updating label '{label}' in '{library_name}': {e}")
+    if journal is not None: journal.update_library(library_name, labelled=labelled, unlabelled=unlabelled, done=True)
+    if cache is not None:
+        cache.set_promoted(library_name, (set(promoted_hubs) - set(unpinned)) | {c.ratingKey for c in pinned})
+        if label:
+            cache.update_labels(library_name, labelled, label, add=True)
+            cache.update_labels(library_name, unlabelled, label, add=False)
+
+    summary['added'] = [getattr(c, 'title', 'Untitled') for c in pinned]
+    summary['removed'] = [to_demote[k].title for k in unpinned]
+    summary['kept'] = [getattr(c, 'title', 'Untitled') for c in kept]
+    logging.info(f"Rotation summary for '{library_name}': added {summary['added']}, removed {summary['removed']}, kept {summary['kept']}")
+    return summary
+
+
+def get_active_special_collections(config, current_date=None):
+    """Determines which 'special' collections are active based on current date."""
+    current_date = current_date or datetime.now().date()
+    unique_active = list(compile_config(config).special_index.active_on(current_date))
     if unique_active: logging.info(f"Active special collections: {unique_active}")
     return unique_active
 
 def get_fully_excluded_collections(config, active_special_collections):
     """Combines explicit exclusions and inactive special collections."""
-    exclusion_raw = config.get('exclusion_list', []); exclusion_set = set(n for n in exclusion_raw if isinstance(n, str))
-    all_special = get_all_special_collection_names(config)
-    inactive = all_special - set(active_special_collections)
-    if inactive: logging.info(f"Excluding inactive special collections by title: {inactive}")
-    combined = exclusion_set.union(inactive)
-    logging.info(f"Total title exclusions (explicit + inactive special): {combined or 'None'}")
+    config = compile_config(config)
+    inactive = config.all_special_names - set(active_special_collections)
+    combined = config.exclusion_set.union(inactive)
+    logging.info(f"Total title exclusions: {len(combined)} ({len(config.exclusion_set)} explicit, {len(inactive)} inactive special).")
+    if combined and logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Explicit exclusions: {sorted(config.exclusion_set)}; inactive specials: {sorted(inactive)}")
     return combined
 
 def get_all_special_collection_names(config):
     """Returns a set of all collection names defined in special_collections config."""
-    all_special_titles = set()
-    special_configs = config.get('special_collections', [])
-    if not isinstance(special_configs, list):
-        logging.warning("'special_collections' in config is not a list. Cannot identify all special titles.")
-        return all_special_titles
-    for special in special_configs:
-        if isinstance(special, dict) and 'collection_names' in special and isinstance(special['collection_names'], list):
-             all_special_titles.update(name for name in special['collection_names'] if isinstance(name, str))
-        else:
-            logging.warning(f"Skipping invalid entry when getting all special names: {special}")
+    all_special_titles = set(compile_config(config).all_special_names)
     if all_special_titles:
         logging.info(f"Identified {len(all_special_titles)} unique titles defined across all special_collections entries.")
     return all_special_titles
 
-def select_from_categories(categories_config, all_collections, exclusion_set, remaining_slots, regex_patterns):
+class EligibilityIndex:
+    """Per-cycle lookup tables for one library: eligible collections by title, active specials and category candidates."""
+    def __init__(self, config, all_collections, active_special_collections, library_name, recently_pinned):
+        config = compile_config(config)
+        min_items_threshold = config.get('min_items_for_pinning', 10)
+        logging.info(f"Filtering: Min items required = {min_items_threshold}")
+        active_specials = set(active_special_collections)
+        fully_excluded_collections = get_fully_excluded_collections(config, active_special_collections)
+        regex_matcher = config.regex_matcher
+        include_set = None
+        if config.get('use_inclusion_list', False) is True:
+            include_raw = config.get('include_list', [])
+            include_set = set(n for n in include_raw if isinstance(n, str)) if isinstance(include_raw, list) else set()
+            logging.info(f"Inclusion list enabled: only {len(include_set)} listed titles (plus active specials) are eligible.")
+
+        self.by_title = {} # title -> collection, for every titled collection in the library
+        self.eligible = {} # title -> collection, insertion order = library order
+        self.excluded = Counter() # reason -> collections excluded for it; per-title lines are DEBUG only
+        detail = logging.getLogger().isEnabledFor(logging.DEBUG)
+        logging.info(f"Starting with {len(all_collections)} collections in '{library_name}'.")
+        for c in all_collections:
+            coll_title = getattr(c, 'title', None);
+            if not coll_title: continue
+            self.by_title.setdefault(coll_title, c)
+            if coll_title in fully_excluded_collections:
+                self.excluded['exclusion_list'] += 1
+                if detail: logging.debug(f"Excluding '{coll_title}' (exclusion list or inactive special)")
+                continue
+            if include_set is not None and coll_title not in include_set and coll_title not in active_specials:
+                self.excluded['not_included'] += 1
+                if detail: logging.debug(f"Excluding '{coll_title}' (not in inclusion list)")
+                continue
+            matched = regex_matcher.match(coll_title)
+            if matched:
+                self.excluded['regex'] += 1
+                if detail: logging.debug(f"Excluding '{coll_title}' (regex: '{matched}')")
+                continue
+            try:
+                item_count = c.childCount
+                if item_count < min_items_threshold:
+                     self.excluded['low_count'] += 1
+                     if detail: logging.debug(f"Excluding '{coll_title}' (low count: {item_count})")
+                     continue
+            except Exception as e:
+                 self.excluded['count_error'] += 1
+                 logging.warning(f"Excluding '{coll_title}' (count error: {e})")
+                 continue
+
+            if coll_title not in active_specials and coll_title in recently_pinned:
+                 self.excluded['recently_pinned'] += 1
+                 if detail: logging.debug(f"Excluding '{coll_title}' (recently pinned non-special item).")
+                 continue
+
+            self.eligible.setdefault(coll_title, c)
+        if self.excluded:
+            logging.info(f"Excluded {sum(self.excluded.values())} collections in '{library_name}': {', '.join(f'{reason}={n}' for reason, n in self.excluded.most_common())}")
+
+        self.specials = [c for t, c in self.eligible.items() if t in active_specials]
+        self.categories = {} # category -> eligible collections named in it
+        for category, collection_names in config.category_sets.get(library_name, {}).items():
+            self.categories[category] = [self.eligible[n] for n in collection_names if n in self.eligible]
+        self._pool = list(self.eligible.values())
+        logging.info(f"Found {len(self.eligible)} eligible collections for selection priority.")
+
+    def random_candidates(self, count, exclude_titles):
+        """Returns up to count random eligible collections not in exclude_titles, sampling O(count) items."""
+        excluded_in_pool = sum(1 for t in exclude_titles if t in self.eligible)
+        count = min(count, len(self._pool) - excluded_in_pool)
+        if count <= 0: return []
+        sample = random.sample(self._pool, min(len(self._pool), count + excluded_in_pool))
+        return [c for c in sample if c.title not in exclude_titles][:count]
+
+def select_from_categories(categories_config, candidates_by_category, exclusion_set, remaining_slots):
     """Selects items from categories based on config."""
     collections_to_pin = []
     config_dict = categories_config if isinstance(categories_config, dict) else {}
-    always_call = config_dict.pop('always_call', True)
-    category_items = config_dict.items()
-    processed_titles_in_this_step = set()
-    for category, collection_names in category_items:
+    always_call = config_dict.get('always_call', True)
+    for category, candidates in candidates_by_category.items():
         if remaining_slots <= 0: break
-        if not isinstance(collection_names, list): continue
-        potential_pins = [
-            c for c in all_collections
-            if getattr(c, 'title', None) in collection_names
-            and getattr(c, 'title', None) not in exclusion_set
-            and not is_regex_excluded(getattr(c, 'title', ''), regex_patterns)
-            and getattr(c, 'title', None) not in processed_titles_in_this_step
-        ]
+        potential_pins = [c for c in candidates if c.title not in exclusion_set]
         if potential_pins:
             if always_call or random.choice([True, False]):
                 selected = random.choice(potential_pins)
                 collections_to_pin.append(selected)
-                processed_titles_in_this_step.add(selected.title)
                 exclusion_set.add(selected.title)
                 logging.info(f"Added '{selected.title}' from category '{category}'")
                 remaining_slots -= 1
-    if isinstance(categories_config, dict): categories_config['always_call'] = always_call
     return collections_to_pin, remaining_slots
 
-def fill_with_random_collections(random_collections_pool, remaining_slots):
-    """Fills remaining slots with random choices."""
-    collections_to_pin = []
-    available = random_collections_pool[:]
-    if not available: logging.info("No items left for random."); return collections_to_pin
-    random.shuffle(available)
-    num = min(remaining_slots, len(available))
-    logging.info(f"Selecting up to {num} random collections from {len(available)}.")
-    selected = available[:num]
-    collections_to_pin.extend(selected)
+def fill_with_random_collections(index, remaining_slots, exclude_titles=(), deck=None, library_name=None, weight=None):
+    """Fills remaining slots with random eligible collections from the index (dealt from the deck if given), skipping exclude_titles."""
+    available_count = len(index.eligible) - sum(1 for t in exclude_titles if t in index.eligible)
+    if available_count <= 0: logging.info("No items left for random."); return []
+    num = min(remaining_slots, available_count)
+    logging.info(f"Selecting up to {num} random collections from {available_count}.")
+    if deck is not None: selected = deck.deal(library_name, index, num, exclude_titles, weight)
+    else: selected = index.random_candidates(num, exclude_titles)
     for c in selected: logging.info(f"Added random collection '{getattr(c, 'title', 'Untitled')}'")
-    return collections_to_pin
+    return selected
 
-def filter_collections(config, all_collections, active_special_collections, collection_limit, library_name, selected_collections):
-    """Filters collections and selects pins, using config threshold."""
-    min_items_threshold = config.get('min_items_for_pinning', 10)
-    logging.info(f"Filtering: Min items required = {min_items_threshold}")
-
-    fully_excluded_collections = get_fully_excluded_collections(config, active_special_collections)
-    recently_pinned_non_special = get_recently_pinned_collections(selected_collections, config)
-    regex_patterns = config.get('regex_exclusion_patterns', [])
-    title_exclusion_set = fully_excluded_collections.union(recently_pinned_non_special)
-
-    eligible_collections = []
-    logging.info(f"Starting with {len(all_collections)} collections in '{library_name}'.")
-    for c in all_collections:
-        coll_title = getattr(c, 'title', None);
-        if not coll_title: continue
-        if coll_title in fully_excluded_collections: continue
-        if is_regex_excluded(coll_title, regex_patterns): continue
-        try:
-            item_count = c.childCount
-            if item_count < min_items_threshold:
-                 logging.info(f"Excluding '{coll_title}' (low count: {item_count})")
-                 continue
-        except AttributeError:
-             logging.warning(f"Excluding '{coll_title}' (AttributeError getting childCount)")
-             continue
-        except Exception as e:
-             logging.warning(f"Excluding '{coll_title}' (count error: {e})")
-             continue
-
-        if coll_title not in active_special_collections and coll_title in recently_pinned_non_special:
-             logging.info(f"Excluding '{coll_title}' (recently pinned non-special item).")
-             continue
-
-        eligible_collections.append(c)
-
-    logging.info(f"Found {len(eligible_collections)} eligible collections for selection priority.")
+def filter_collections(config, all_collections, active_special_collections, collection_limit, library_name, history, recently_pinned=None, deck=None):
+    """Filters collections and selects pins, using config threshold (recently_pinned skips the history lookup, deck replaces plain random picks)."""
+    recently_pinned_non_special = recently_pinned if recently_pinned is not None else get_recently_pinned_collections(history, config)
+    index = EligibilityIndex(config, all_collections, active_special_collections, library_name, recently_pinned_non_special)
+    get_metrics().set_count(library_name, 'eligible', len(index.eligible))
+    get_metrics().set_count(library_name, 'excluded', len(index.by_title) - len(index.eligible))
+    for reason, count in index.excluded.items(): get_metrics().set_count(library_name, f'excluded_{reason}', count)
 
     collections_to_pin = []; pinned_titles = set(); remaining = collection_limit
 
     # Step 1: Special
-    specials = [c for c in eligible_collections if c.title in active_special_collections][:remaining]
+    specials = index.specials[:remaining]
     collections_to_pin.extend(specials); pinned_titles.update(c.title for c in specials); remaining -= len(specials)
     if specials: logging.info(f"Added {len(specials)} special: {[c.title for c in specials]}. Left: {remaining}")
 
     # Step 2: Categories
     if remaining > 0:
         cat_conf = config.get('categories', {}).get(library_name, {});
-        eligible_cat = [c for c in eligible_collections if c.title not in pinned_titles]
-        cat_pins, remaining = select_from_categories(cat_conf, eligible_cat, pinned_titles.copy(), remaining, regex_patterns)
+        cat_pins, remaining = select_from_categories(cat_conf, index.categories, pinned_titles.copy(), remaining)
         collections_to_pin.extend(cat_pins); pinned_titles.update(c.title for c in cat_pins)
         if cat_pins: logging.info(f"Added {len(cat_pins)} from categories. Left: {remaining}")
 
     # Step 3: Random
     if remaining > 0:
-        eligible_rand = [c for c in eligible_collections if c.title not in pinned_titles]
-        rand_pins = fill_with_random_collections(eligible_rand, remaining)
+        rand_pins = fill_with_random_collections(index, remaining, pinned_titles, deck, library_name, get_rotation_weight(config))
         collections_to_pin.extend(rand_pins)
+    if deck is not None: deck.mark_dealt(library_name, pinned_titles)
 
     logging.info(f"Final list for '{library_name}': {[c.title for c in collections_to_pin]}")
     return collections_to_pin
 
+def process_library(plex, library_name, config, pin_limit, recently_pinned, exclusion_set, executor=None, cache=None, journal=None, deck=None, dry_run=False):
+    """Selects and rotates the pins for one library; returns (selected titles, rotation summary)."""
+    library_process_start = time.time()
+    if not isinstance(pin_limit, int) or pin_limit < 0: pin_limit = 0
+
+    colls_to_pin = []
+    if pin_limit == 0:
+        logging.info(f"'{library_name}': Pin limit is 0, only unpinning.")
+    else:
+        logging.info(f"Processing '{library_name}' for pinning (Limit: {pin_limit})")
+        active_specials = get_active_special_collections(config) # Get currently active specials
+        # A failed listing must not read as an empty library: that would demote and unlabel every current pin
+        try: all_colls_in_lib = get_collections_from_all_libraries(plex, [library_name], cache=cache, filters=get_server_filters(config), raise_errors=True)
+        except Exception as e: raise RuntimeError(f"could not list collections ({e}); keeping the current pins") from e
+        if not all_colls_in_lib: logging.info(f"No collections found in '{library_name}' to process.")
+        # Filter and select collections to pin for this specific library
+        else:
+            with get_metrics().phase('filter', library_name):
+                colls_to_pin = filter_collections(config, all_colls_in_lib, active_specials, pin_limit, library_name, None, recently_pinned, deck)
+
+    if not colls_to_pin: logging.info(f"No collections selected for pinning in '{library_name}'.")
+    # Diff against what is promoted now and only touch the collections that change
+    summary = rotate_library_collections(plex, library_name, colls_to_pin, exclusion_set, config, executor, cache, journal, dry_run)
+
+    logging.info(f"Finished processing '{library_name}' in {time.time() - library_process_start:.2f}s.")
+    return [c.title for c in colls_to_pin if hasattr(c, 'title')], summary
+
+# --- Cycle Journal ---
+class CycleJournal:
+    """Small JSON file tracking the running cycle: intended pins per library, what was applied, and the next run.
+
+    It is rewritten (atomically) at each step of a cycle, so after a restart the cycle can be resumed, or the
+    early reshuffle of a completed one skipped, instead of starting over (see resume_cycle).
+    """
+    def __init__(self, path=CYCLE_JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = None
+        self.load()
+
+    def load(self):
+        """Loads the journal, ignoring it if it is missing, invalid or from another version."""
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: state = json.load(f)
+            if not isinstance(state, dict) or state.get('version') != CYCLE_JOURNAL_VERSION: raise ValueError("unsupported format")
+            for entry in state.get('libraries', {}).values(): entry['intended'] = {int(k): v for k, v in entry.get('intended', {}).items()}
+            self.state = state
+        except Exception as e: logging.warning(f"Ignoring cycle journal {self.path}: {e}")
+
+    def _save(self):
+        # Called with the lock held
+        try: _write_atomic(self.path, json.dumps(self.state, ensure_ascii=False))
+        except Exception as e: logging.error(f"Error saving {self.path}: {e}")
+
+    def begin(self, next_run, active_specials, library_names):
+        """Starts a new cycle entry for the given libraries."""
+        with self._lock:
+            self.state = {'version': CYCLE_JOURNAL_VERSION, 'status': 'in_progress', 'started_at': time.time(), 'next_run': next_run,
+                          'active_specials': sorted(active_specials), 'library_names': list(library_names), 'libraries': {}}
+            self._save()
+
+    def plan_library(self, library_name, collections):
+        """Records the pin set chosen for a library before anything is changed on the server."""
+        intended = {c.ratingKey: getattr(c, 'title', 'Untitled') for c in collections if getattr(c, 'ratingKey', None) is not None}
+        with self._lock:
+            if self.state is None: return
+            self.state['libraries'][library_name] = {'intended': intended, 'done': False}
+            self._save()
+
+    def update_library(self, library_name, **progress):
+        """Records completed steps for a library (pinned/unpinned/labelled keys, done)."""
+        with self._lock:
+            entry = self.state['libraries'].get(library_name) if self.state else None
+            if entry is None: return
+            entry.update(progress)
+            self._save()
+
+    def finish(self):
+        """Marks the cycle complete (after the pin history was recorded)."""
+        with self._lock:
+            if self.state is None: return
+            self.state['status'] = 'complete'; self.state['finished_at'] = time.time()
+            self._save()
+
+    def pinned_titles(self):
+        """Titles of every collection the journalled cycle meant to pin."""
+        with self._lock:
+            if self.state is None: return set()
+            return {title for entry in self.state['libraries'].values() for title in entry['intended'].values()}
+
+# --- Scheduling ---
+def get_next_special_boundary(config, now):
+    """Returns the earliest datetime after now at which a special_collections window starts or ends, or None."""
+    return compile_config(config).special_index.next_boundary(now)
+
+class CycleScheduler:
+    """Waits for the next cycle: the interval deadline, a special-window boundary or a relevant library change.
+
+    clock (epoch seconds) and wake_event (anything with wait/set/clear) are injectable for testing.
+    """
+    def __init__(self, clock=time.time, wake_event=None):
+        self.clock = clock
+        self.wake_event = wake_event if wake_event is not None else threading.Event()
+        self.last_cycle_end = None
+        self.cycle_running = False # events during a cycle are our own pin/label edits
+        self._changes = []
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_plex = None
+
+    def library_changed(self, section_id, title, state):
+        """Records a collection change reported by Plex and wakes the scheduler."""
+        if self.cycle_running or self.last_cycle_end is None or self.clock() - self.last_cycle_end < OWN_CHANGE_GRACE: return
+        with self._lock: self._changes.append((section_id, title, state))
+        self.wake_event.set()
+
+    def handle_alert(self, data):
+        """plexapi alert callback: forwards collection timeline entries to library_changed."""
+        if not isinstance(data, dict) or data.get('type') != 'timeline': return
+        for entry in data.get('TimelineEntry', []):
+            if entry.get('identifier') != 'com.plexapp.plugins.library' or int(entry.get('type', 0)) != 18: continue
+            self.library_changed(str(entry.get('sectionID')), entry.get('title'), int(entry.get('state', -1)))
+
+    def pop_changes(self):
+        """Returns and clears the pending library changes."""
+        with self._lock: changes, self._changes = self._changes, []
+        return changes
+
+    def has_changes(self):
+        with self._lock: return bool(self._changes)
+
+    def cycle_started(self):
+        self.cycle_running = True
+
+    def cycle_finished(self):
+        """Ends a cycle: starts the own-edit grace period and drops wake-ups recorded before or during the cycle."""
+        self.last_cycle_end = self.clock()
+        self.cycle_running = False
+        self.pop_changes()
+        self.wake_event.clear() # shared between servers; main() sets it again if another server has pending changes
+
+    def start_listener(self, plex, config):
+        """Starts (or restarts after a reconnect) the Plex alert listener when listen_for_library_changes is set."""
+        if config.get('listen_for_library_changes', False) is not True: self.stop_listener(); return
+        if self._listener is not None and self._listener_plex is plex: return
+        self.stop_listener()
+        if importlib.util.find_spec('websocket') is None:
+            logging.warning("'listen_for_library_changes' needs the websocket-client package. Library change events disabled."); return
+        try:
+            self._listener = plex.startAlertListener(self.handle_alert, lambda e: logging.warning(f"Plex alert listener error: {e}"))
+            self._listener_plex = plex
+            logging.info("Listening for library changes.")
+        except Exception as e: logging.warning(f"Could not start Plex alert listener: {e}")
+
+    def stop_listener(self):
+        if self._listener is not None:
+            try: self._listener.stop()
+            except Exception: pass
+        self._listener = None; self._listener_plex = None
+
+    def next_wake(self, config, deadline):
+        """Returns (wake time, reason) for the earlier of the deadline and the next special-window boundary."""
+        boundary = get_next_special_boundary(config, datetime.fromtimestamp(self.clock()))
+        if boundary is not None and boundary.timestamp() < deadline: return boundary.timestamp(), 'special_window'
+        return deadline, 'interval'
+
+    def wait(self, config, deadline):
+        """Blocks until the next wake-up; returns 'interval', 'special_window' or 'library_change'."""
+        while True:
+            wake_at, reason = self.next_wake(config, deadline)
+            remaining = wake_at - self.clock()
+            if remaining > 0 and self.wake_event.wait(remaining):
+                self.wake_event.clear()
+                # Let a burst of edits (e.g. a Kometa run) settle before acting on it
+                debounce_until = min(self.clock() + LIBRARY_CHANGE_DEBOUNCE, wake_at)
+                while self.clock() < debounce_until:
+                    self.wake_event.wait(debounce_until - self.clock()); self.wake_event.clear()
+                return 'library_change'
+            if self.clock() >= wake_at: return reason
+
+def record_cycle_history(pin_history, config, titles):
+    """Adds the non-special titles pinned this cycle to the pin history."""
+    current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    all_special_titles = get_all_special_collection_names(config) # Get all defined special titles
+    if titles:
+         unique_new_pins_all = set(titles)
+         non_special_pins_for_history = {
+             title for title in unique_new_pins_all
+             if title not in all_special_titles
+         }
+         if non_special_pins_for_history:
+              history_entry = sorted(list(non_special_pins_for_history))
+              with get_metrics().phase('history'): pin_history.record(history_entry)
+              logging.info(f"Updated history for {current_timestamp} with {len(history_entry)} non-special items.")
+              if len(unique_new_pins_all) > len(non_special_pins_for_history):
+                  logging.info(f"Note: {len(unique_new_pins_all) - len(non_special_pins_for_history)} special collection(s) were pinned but not added to recency history.")
+         else:
+              logging.info("Only special collections were pinned this cycle. History not updated for recency blocking.")
+    else:
+         logging.info("Nothing pinned this cycle, history not updated.")
+
+def run_cycle(plex, config, collection_cache, pin_history, library_pool=None, op_pool=None, journal=None, next_run=None, deck=None):
+    """Runs one selection/rotation cycle on a connected server and records history; returns the selected titles.
+
+    With a journal, each step is recorded so an interrupted cycle can be resumed after a restart (next_run is stored with it).
+    With a RotationDeck, random picks are dealt from it instead of sampled independently each cycle.
+    """
+    max_workers, _ = get_concurrency_limits(config)
+    if library_pool is None or op_pool is None:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='library') as library_pool, \
+             ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='plex-op') as op_pool:
+            return run_cycle(plex, config, collection_cache, pin_history, library_pool, op_pool, journal, next_run, deck)
+    # Fetch necessary config values
+    exclusion_list = config.get('exclusion_list', []);
+    if not isinstance(exclusion_list, list): exclusion_list = []
+    library_names = config.get('library_names', [])
+    if not isinstance(library_names, list): library_names = []
+    collections_per_library_config = config.get('number_of_collections_to_pin', {})
+    if not isinstance(collections_per_library_config, dict): collections_per_library_config = {}
+
+    newly_pinned_titles_this_run = [] # Track all pins for this run's history update
+    exclusion_set = set(n for n in exclusion_list if isinstance(n, str))
+    cycle_summary = {'added': 0, 'removed': 0, 'kept': 0}
+
+    # Looked up once per cycle and shared by all library workers
+    with get_metrics().phase('history'): recently_pinned = get_recently_pinned_collections(pin_history, config)
+    valid_libraries = []
+    for library_name in library_names:
+        if not isinstance(library_name, str): logging.warning(f"Skipping invalid library name: {library_name}"); continue
+        valid_libraries.append(library_name)
+    if journal is not None: journal.begin(next_run, get_active_special_collections(config), valid_libraries)
+
+    # --- Plan and Apply Rotation for Each Library (in parallel, logs replayed in library order) ---
+    process = lambda name: process_library(plex, name, config, collections_per_library_config.get(name, 0), recently_pinned, exclusion_set, op_pool, collection_cache, journal, deck)
+    for library_name, result, error in map_ordered(library_pool, process, valid_libraries):
+        if error: logging.error(f"Error processing library '{library_name}': {error}"); get_metrics().error('library', library_name); continue
+        pinned_titles, summary = result
+        for key in cycle_summary: cycle_summary[key] += len(summary[key]); get_metrics().set_count(library_name, key, len(summary[key]))
+        get_metrics().set_count(library_name, 'pinned', len(pinned_titles))
+        # Add titles to list for this run's history update
+        newly_pinned_titles_this_run.extend(pinned_titles)
+    # --- End Library Loop ---
+    collection_cache.save()
+    if deck is not None: deck.save()
+    logging.info(f"Cycle rotation summary: {cycle_summary['added']} added, {cycle_summary['removed']} removed, {cycle_summary['kept']} kept.")
+
+    # --- Update History File (only non-special) ---
+    record_cycle_history(pin_history, config, newly_pinned_titles_this_run)
+    if journal is not None: journal.finish()
+    return set(newly_pinned_titles_this_run)
+
+def resume_cycle(plex, config, journal, collection_cache, pin_history, library_pool=None, op_pool=None, deck=None):
+    """Reconciles the server with the journal after a restart; returns the pinned titles.
+
+    Libraries whose journalled rotation did not finish are rotated to the intended pin set. For finished ones one
+    managed-hubs request checks the pins are still there; only missing pins are re-applied. Libraries an interrupted
+    cycle never got to (no pin set journalled yet) are processed normally.
+    """
+    state = journal.state
+    interrupted = state.get('status') != 'complete'
+    exclusion_list = config.get('exclusion_list', [])
+    exclusion_set = set(n for n in exclusion_list if isinstance(n, str)) if isinstance(exclusion_list, list) else set()
+    library_names = config.get('library_names', [])
+    if not isinstance(library_names, list): library_names = []
+    collections_per_library_config = config.get('number_of_collections_to_pin', {})
+    if not isinstance(collections_per_library_config, dict): collections_per_library_config = {}
+    journalled = dict(state.get('libraries', {})) # snapshot; rotations below update the journal
+    libraries = [name for name in journalled if name in library_names]
+    unstarted = [name for name in state.get('library_names', []) if interrupted and name not in journalled and name in library_names]
+    logging.info(f"{'Resuming interrupted' if interrupted else 'Checking last'} cycle from {journal.path} (started {datetime.fromtimestamp(state.get('started_at', 0)).strftime('%Y-%m-%d %H:%M:%S')}).")
+    recently_pinned = None
+    if unstarted:
+        logging.info(f"Libraries not reached before the interruption: {unstarted}. Processing them now.")
+        with get_metrics().phase('history'): recently_pinned = get_recently_pinned_collections(pin_history, config)
+
+    def reconcile(library_name):
+        if library_name not in journalled:
+            return process_library(plex, library_name, config, collections_per_library_config.get(library_name, 0), recently_pinned,
+                                   exclusion_set, op_pool, collection_cache, journal, deck)[1]
+        entry = journalled[library_name]
+        intended = entry['intended']
+        with get_metrics().phase('fetch', library_name): library = plex.library.section(library_name)
+        if entry.get('done'):
+            with get_metrics().phase('fetch', library_name): promoted_hubs = get_promoted_collection_hubs(library)
+            missing = [title for rk, title in intended.items() if rk not in promoted_hubs]
+            if not missing: logging.info(f"'{library_name}' matches the journal ({len(intended)} pinned)."); return None
+            logging.info(f"'{library_name}': {len(missing)} journalled pin(s) missing ({missing}). Re-applying.")
+        # The section key lets kept collections pass the section check of the label multi-edit
+        records = [CollectionRecord(rk, title, librarySectionID=library.key) for rk, title in intended.items()]
+        return rotate_library_collections(plex, library_name, records, exclusion_set, config, op_pool, collection_cache, journal)
+
+    for library_name, summary, error in map_ordered(library_pool, reconcile, libraries + unstarted):
+        if error: logging.error(f"Error resuming library '{library_name}': {error}"); get_metrics().error('library', library_name); continue
+        if summary is None: continue
+        for key in ('added', 'removed', 'kept'): get_metrics().set_count(library_name, key, len(summary[key]))
+    collection_cache.save()
+    if deck is not None: deck.save()
+
+    pinned_titles = journal.pinned_titles()
+    if interrupted:
+        record_cycle_history(pin_history, config, pinned_titles)
+        journal.finish()
+    return pinned_titles
+
+def plan_cycle(plex, config, collection_cache, pin_history, deck=None):
+    """Selects the next pins like run_cycle without changing anything on Plex; returns {library: {'pin', 'unpin', 'keep'}}.
+
+    Cache and deck changes stay in memory (callers do not save them), so a plan leaves no trace.
+    """
+    exclusion_list = config.get('exclusion_list', [])
+    exclusion_set = set(n for n in exclusion_list if isinstance(n, str)) if isinstance(exclusion_list, list) else set()
+    library_names = config.get('library_names', [])
+    if not isinstance(library_names, list): library_names = []
+    collections_per_library_config = config.get('number_of_collections_to_pin', {})
+    if not isinstance(collections_per_library_config, dict): collections_per_library_config = {}
+    recently_pinned = get_recently_pinned_collections(pin_history, config)
+    plan = {}
+    for library_name in library_names:
+        if not isinstance(library_name, str): logging.warning(f"Skipping invalid library name: {library_name}"); continue
+        try:
+            _, summary = process_library(plex, library_name, config, collections_per_library_config.get(library_name, 0), recently_pinned,
+                                         exclusion_set, cache=collection_cache, deck=deck, dry_run=True)
+            plan[library_name] = {'pin': summary['added'], 'unpin': summary['removed'], 'keep': summary['kept']}
+        except Exception as e: logging.error(f"Error planning library '{library_name}': {e}"); plan[library_name] = {'error': str(e)}
+    return plan
+
+def _server_file_tag(server_name):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', server_name)
+
+def _namespaced_path(path, server_name):
+    """Inserts the server name before the file extension (path unchanged in single-server mode)."""
+    if not server_name: return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{_server_file_tag(server_name)}{ext}"
+
+class WorkerPools:
+    """Thread pools shared by every server, one per nesting level (server, library, plex-op) so nested map_ordered calls cannot deadlock."""
+    def __init__(self):
+        self.size = None
+        self.server = self.library = self.op = None
+
+    def resize(self, size):
+        """(Re)creates the pools when max_workers changes; threads are only started as work arrives."""
+        if size == self.size: return
+        self.shutdown()
+        self.size = size
+        self.server = ThreadPoolExecutor(max_workers=size, thread_name_prefix='server')
+        self.library = ThreadPoolExecutor(max_workers=size, thread_name_prefix='library')
+        self.op = ThreadPoolExecutor(max_workers=size, thread_name_prefix='plex-op')
+
+    def shutdown(self):
+        for pool in (self.server, self.library, self.op):
+            if pool is not None: pool.shutdown(wait=True)
+        self.server = self.library = self.op = None; self.size = None
+
+class ManagedServer:
+    """One Plex server's state across cycles: connection, collection cache, pin history and wake-up bookkeeping."""
+    def __init__(self, name, scheduler):
+        self.name = name
+        self.scheduler = scheduler
+        self.config = None
+        self.connection = PlexConnectionManager()
+        self.cache = CollectionCache(_namespaced_path(COLLECTION_CACHE_FILE, name))
+        self.history = PinHistory(_namespaced_path(PIN_HISTORY_FILE, name), SELECTED_COLLECTIONS_FILE if not name else None)
+        self.journal = CycleJournal(_namespaced_path(CYCLE_JOURNAL_FILE, name))
+        self.deck = RotationDeck(_namespaced_path(ROTATION_DECK_FILE, name))
+        self.deadline = 0 # due immediately
+        self.last_active_specials, self.last_pinned_titles = set(), set()
+        # After a restart before the journalled next run: resume/verify the last cycle instead of starting a new one
+        self.resume_until = None
+        state = self.journal.state
+        if state and isinstance(state.get('next_run'), (int, float)) and state['next_run'] > scheduler.clock():
+            self.resume_until = state['next_run']
+            self.last_active_specials = set(state.get('active_specials', []))
+            self.last_pinned_titles = self.journal.pinned_titles()
+
+    def run(self, pools, once=False):
+        """Connects and runs one cycle; schedules the next interval (or reconnect attempt). Returns True if Plex was reached."""
+        config = self.config
+        with server_context(self.name):
+            pin_interval = config.get('pinning_interval', 60);
+            if not isinstance(pin_interval, (int, float)) or pin_interval <= 0: pin_interval = 60
+            now = self.scheduler.clock()
+            resume = self.resume_until is not None and now < self.resume_until
+            self.deadline = min(self.resume_until, now + pin_interval * 60) if resume else now + pin_interval * 60
+            with get_metrics().phase('connect'): plex = self.connection.get(config)
+            if plex and not once: self.scheduler.start_listener(plex, config) # a one-shot run never waits for events
+            if not plex:
+                get_metrics().error('connect')
+                retry_sec = self.connection.retry_delay(pin_interval * 60)
+                self.deadline = self.scheduler.clock() + retry_sec
+                if once: logging.error("Plex connection failed.") # no retry in a one-shot run
+                else: logging.error(f"Plex connection failed ({self.connection.failures} in a row). Retrying in {retry_sec:.0f}s.")
+            else:
+                self.scheduler.cycle_started()
+                try:
+                    if resume:
+                        self.last_pinned_titles = resume_cycle(plex, config, self.journal, self.cache, self.history, pools.library, pools.op, self.deck)
+                        logging.info(f"Next cycle at {datetime.fromtimestamp(self.deadline).strftime('%Y-%m-%d %H:%M:%S')} as journalled.")
+                    else:
+                        self.last_pinned_titles = run_cycle(plex, config, self.cache, self.history, pools.library, pools.op, self.journal, self.deadline, self.deck)
+                        self.last_active_specials = set(get_active_special_collections(config, self.today()))
+                    self.resume_until = None
+                finally: self.scheduler.cycle_finished()
+            return plex is not None
+
+    def is_due(self):
+        return self.resume_until is not None or self.scheduler.clock() >= self.deadline
+
+    def next_wake(self):
+        return self.scheduler.next_wake(self.config, self.deadline)
+
+    def today(self):
+        """The scheduler clock's date, so special windows are checked against the same time that triggered the wake-up."""
+        return datetime.fromtimestamp(self.scheduler.clock()).date()
+
+    def check_wake(self, reason):
+        """Decides, after the scheduler woke up for reason, whether this server needs a cycle now."""
+        if self.scheduler.clock() >= self.deadline: return True
+        with server_context(self.name):
+            active_now = set(get_active_special_collections(self.config, self.today()))
+            changes = self.scheduler.pop_changes()
+            if active_now != self.last_active_specials: logging.info("Special collection window changed. Starting cycle early."); return True
+            if reason == 'special_window': logging.info("Special window boundary reached but active specials are unchanged. Skipping cycle.")
+            relevant = [title for _, title, state in changes if title in active_now or (state == 9 and title in self.last_pinned_titles)]
+            if relevant: logging.info(f"Library change affects pinning ({relevant}). Starting cycle early."); return True
+            if changes: logging.info(f"Ignoring {len(changes)} library change(s) that do not affect pinned or special collections.")
+            return False
+
+    def close(self):
+        self.scheduler.stop_listener()
+        self.connection.close()
+        self.cache.save()
+        self.deck.save()
+
 # --- Main Function ---
-def main():
-    """Main execution loop."""
+def check_config_essentials(server_configs):
+    """Returns False (after logging why) if a server config lacks a setting ColleXions cannot run without."""
+    for name, server_config in server_configs:
+        if not all(k in server_config for k in ['plex_url', 'plex_token', 'pinning_interval', 'collexions_label']): # Check for label presence
+            where = f" for server '{name}'" if name else ""
+            logging.critical(f"Config essentials missing{where} (plex_url, plex_token, pinning_interval, collexions_label). Exit."); return False
+    return True
+
+def plan():
+    """--plan: prints the next pin plan of every configured server as JSON, changing nothing on Plex or on disk; returns the exit code."""
+    config = load_config()
+    set_log_level(config.get('log_level'))
+    server_configs = config.server_configs()
+    if not check_config_essentials(server_configs): return EXIT_CONFIG_ERROR
+    result, status = {}, EXIT_OK
+    for name, server_config in server_configs:
+        with server_context(name):
+            key = name or server_config.get('plex_url')
+            plex = connect_to_plex(server_config)
+            if plex is None: result[key] = {'error': "Plex server unreachable"}; status = EXIT_PLEX_UNREACHABLE; continue
+            history = PinHistory(_namespaced_path(PIN_HISTORY_FILE, name), SELECTED_COLLECTIONS_FILE if not name else None, read_only=True)
+            deck = RotationDeck(_namespaced_path(ROTATION_DECK_FILE, name))
+            result[key] = plan_cycle(plex, server_config, CollectionCache(_namespaced_path(COLLECTION_CACHE_FILE, name)), history, deck)
+            if status == EXIT_OK and any('error' in entry for entry in result[key].values()): status = EXIT_CYCLE_ERRORS
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return status
+
+def main(once=False):
+    """Main execution loop; with once, runs a single cycle on every server and returns the exit code."""
+    setup_logging()
     logging.info("Starting Collexions Script")
+    wake_event = threading.Event() # shared by every server's scheduler
+    servers = {} # server name (None in single-server mode) -> ManagedServer
+    pools = WorkerPools()
+    metrics = get_metrics()
+    due = set()
     while True:
         run_start = time.time()
+        metrics.start_cycle()
         # Load config at the start of each cycle
         config = load_config()
-        if not all(k in config for k in ['plex_url', 'plex_token', 'pinning_interval', 'collexions_label']): # Check for label presence
-             logging.critical("Config essentials missing (plex_url, plex_token, pinning_interval, collexions_label). Exit."); sys.exit(1)
-
-        pin_interval = config.get('pinning_interval', 60);
-        if not isinstance(pin_interval, (int, float)) or pin_interval <= 0: pin_interval = 60
-        sleep_sec = pin_interval * 60
-
-        plex = connect_to_plex(config)
-        if not plex:
-            logging.error(f"Plex connection failed. Retrying in {pin_interval} min.")
-        else:
-            # Fetch necessary config values
-            exclusion_list = config.get('exclusion_list', []);
-            if not isinstance(exclusion_list, list): exclusion_list = []
-            library_names = config.get('library_names', [])
-            if not isinstance(library_names, list): library_names = []
-            collections_per_library_config = config.get('number_of_collections_to_pin', {})
-            if not isinstance(collections_per_library_config, dict): collections_per_library_config = {}
-
-            selected_collections_history = load_selected_collections() # Load history
-            current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            newly_pinned_titles_this_run = [] # Track all pins for this run's history update
-
-            all_special_titles = get_all_special_collection_names(config) # Get all defined special titles
-
-            # --- Unpin and Remove Labels First ---
-            # Pass the full config to unpin_collections
-            unpin_collections(plex, library_names, exclusion_list, config)
-            # --- End Unpin ---
-
-            # --- Select and Pin Collections for Each Library ---
-            for library_name in library_names:
-                library_process_start = time.time()
-                if not isinstance(library_name, str): logging.warning(f"Skipping invalid library name: {library_name}"); continue
-
-                pin_limit = collections_per_library_config.get(library_name, 0);
-                if not isinstance(pin_limit, int) or pin_limit < 0: pin_limit = 0
-                if pin_limit == 0: logging.info(f"Skipping '{library_name}': Pin limit is 0."); continue
-
-                logging.info(f"Processing '{library_name}' for pinning (Limit: {pin_limit})")
-                active_specials = get_active_special_collections(config) # Get currently active specials
-                all_colls_in_lib = get_collections_from_all_libraries(plex, [library_name])
-                if not all_colls_in_lib: logging.info(f"No collections found in '{library_name}' to process."); continue
-
-                # Filter and select collections to pin for this specific library
-                colls_to_pin = filter_collections(config, all_colls_in_lib, active_specials, pin_limit, library_name, selected_collections_history)
-
-                if colls_to_pin:
-                    # Pin the selected collections and add labels
-                    pin_collections(colls_to_pin, config)
-                    # Add titles to list for this run's history update
-                    newly_pinned_titles_this_run.extend([c.title for c in colls_to_pin if hasattr(c, 'title')])
-                else:
-                    logging.info(f"No collections selected for pinning in '{library_name}'.")
-
-                logging.info(f"Finished processing '{library_name}' in {time.time() - library_process_start:.2f}s.")
-            # --- End Library Loop ---
-
-            # --- Update History File (only non-special) ---
-            if newly_pinned_titles_this_run:
-                 unique_new_pins_all = set(newly_pinned_titles_this_run)
-                 non_special_pins_for_history = {
-                     title for title in unique_new_pins_all
-                     if title not in all_special_titles
-                 }
-                 if non_special_pins_for_history:
-                      history_entry = sorted(list(non_special_pins_for_history))
-                      selected_collections_history[current_timestamp] = history_entry
-                      save_selected_collections(selected_collections_history)
-                      logging.info(f"Updated history for {current_timestamp} with {len(history_entry)} non-special items.")
-                      if len(unique_new_pins_all) > len(non_special_pins_for_history):
-                          logging.info(f"Note: {len(unique_new_pins_all) - len(non_special_pins_for_history)} special collection(s) were pinned but not added to recency history.")
-                 else:
-                      logging.info("Only special collections were pinned this cycle. History not updated for recency blocking.")
-            else:
-                 logging.info("Nothing pinned this cycle, history not updated.")
-            # --- End History Update ---
+        set_log_level(config.get('log_level'))
+        server_configs = config.server_configs()
+        if not check_config_essentials(server_configs): sys.exit(EXIT_CONFIG_ERROR)
+        configured = dict(server_configs)
+        for name in [n for n in servers if n not in configured]:
+            logging.info(f"Server '{name}' is no longer configured. Dropping it." if name else "Switching to multi-server mode.")
+            servers.pop(name).close()
+        for name, server_config in server_configs:
+            if name not in servers: servers[name] = ManagedServer(name, CycleScheduler(wake_event=wake_event))
+            servers[name].config = server_config
+        start_metrics_server(config.get('metrics_port'))
+        pools.resize(get_concurrency_limits(config)[0])
+
+        # Servers run in parallel on the shared pools; their logs are replayed server by server
+        if once:
+            for server in servers.values(): server.resume_until = None # a one-shot run always runs a full cycle
+        to_run = list(servers.values()) if once else [s for s in servers.values() if s.name in due or s.is_due()]
+        connected, unreachable = False, 0
+        for server, reached, error in map_ordered(pools.server if len(to_run) > 1 else None, lambda s: s.run(pools, once), to_run):
+            if error: logging.error(f"Error running cycle for server '{server.name or config.get('plex_url')}': {error}"); metrics.error('cycle')
+            connected = connected or bool(reached)
+            if not error and not reached: unreachable += 1
+        if any(s.scheduler.has_changes() for s in servers.values()): wake_event.set() # a finishing cycle cleared the shared event
 
         run_end = time.time()
         logging.info(f"Cycle finished in {run_end - run_start:.2f} seconds.")
-        logging.info(f"Sleeping for {pin_interval} minutes...")
-        try: time.sleep(sleep_sec)
-        except KeyboardInterrupt: logging.info("Script interrupted. Exiting."); break
+        summary = metrics.finish_cycle(success=connected)
+        publish_cycle_metrics(config, summary)
+        if once:
+            errors = sum(phase['errors'] for phase in summary['phases'].values())
+            exit_code = EXIT_PLEX_UNREACHABLE if unreachable else EXIT_CYCLE_ERRORS if errors else EXIT_OK
+            logging.info(f"Single cycle done (exit code {exit_code}).")
+            break
+        if connected:
+            minutes = (min(s.deadline for s in servers.values()) - time.time()) / 60
+            logging.info(f"Sleeping for {round(minutes, 1):g} minutes (or until a special window or library change)...")
+        try:
+            while True:
+                earliest = min(servers.values(), key=lambda s: s.next_wake()[0])
+                reason = earliest.scheduler.wait(earliest.config, earliest.deadline)
+                due = {s.name for s in servers.values() if s.check_wake(reason)}
+                if due: break
+        except KeyboardInterrupt: logging.info("Script interrupted. Exiting."); exit_code = EXIT_OK; break
+    for server in servers.values(): server.close()
+    start_metrics_server(None)
+    pools.shutdown()
+    get_discord_notifier().close()
+    return exit_code
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rotates pinned Plex collections on the home screen.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', action='store_true', help="run a single cycle and exit (for cron / Kubernetes CronJobs)")
+    mode.add_argument('--plan', action='store_true', help="print the next pin plan as JSON without changing anything, then exit")
+    parser.epilog = (f"exit codes: {EXIT_OK} ok, {EXIT_CONFIG_ERROR} config error, 2 usage error, "
+                     f"{EXIT_PLEX_UNREACHABLE} Plex unreachable, {EXIT_CYCLE_ERRORS} cycle finished with errors")
+    return parser.parse_args(argv)
 
 # --- Script Entry Point ---
 if __name__ == "__main__":
-    try: main()
+    args = parse_args()
+    # --plan keeps stdout for the JSON plan and writes no log file
+    if args.plan: setup_logging(sys.stderr, to_file=False)
+    else: setup_logging(sys.stdout)
+    try: sys.exit(plan() if args.plan else main(once=args.once))
     except KeyboardInterrupt: logging.info("Script terminated by user.")
-    except Exception as e: logging.critical(f"UNHANDLED EXCEPTION: {e}", exc_info=True); sys.exit(1)
+    except Exception as e: logging.critical(f"UNHANDLED EXCEPTION: {e}", exc_info=True); sys.exit(EXIT_CONFIG_ERROR)
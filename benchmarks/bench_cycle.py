@@ -0,0 +1,136 @@
+# --- Imports ---
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import urllib.request
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import fake_plex
+
+# --- Benchmark: one full pin cycle against the fake Plex server ---
+# Runs ColleXions.run_cycle() (what main() does each interval) once per library size and reports wall time,
+# HTTP requests per endpoint and peak Python memory of the client. The server runs in its own process so it
+# competes for neither the GIL nor the tracemalloc numbers.
+#
+#   python benchmarks/bench_cycle.py                         # 100, 1k, 10k, 50k collections
+#   python benchmarks/bench_cycle.py --output baseline.json
+#   python benchmarks/bench_cycle.py --compare baseline.json  # exit code 1 on regression
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+LIBRARY_NAME = 'Movies'
+
+def _server_process(size, port_queue):
+    server, _ = fake_plex.serve({LIBRARY_NAME: size})
+    port_queue.put(server.server_port)
+    while True: time.sleep(3600)
+
+def start_server(size):
+    """Starts the fake server for one library of `size` collections in a child process; returns (process, base_url)."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_server_process, args=(size, port_queue), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=120)}"
+
+def _server_call(base_url, path):
+    with urllib.request.urlopen(base_url + path, timeout=30) as response: return json.load(response)
+
+def bench_config(base_url):
+    return {
+        "plex_url": base_url, "plex_token": "benchmark", "library_names": [LIBRARY_NAME],
+        "number_of_collections_to_pin": {LIBRARY_NAME: 5}, "min_items_for_pinning": 5, "repeat_block_hours": 12,
+        "exclusion_list": [f"{LIBRARY_NAME} Collection 3"], "regex_exclusion_patterns": ["Collection \\d*13$"],
+        "categories": {LIBRARY_NAME: {"always_call": True, "Favourites": [f"{LIBRARY_NAME} Collection {i}" for i in range(20, 30)]}},
+        "special_collections": [], "collexions_label": "Collexions", "pinning_interval": 180,
+    }
+
+def run_size(C, size, cycles):
+    """Benchmarks `cycles` consecutive cycles (fresh cache and history) at one library size."""
+    process, base_url = start_server(size)
+    workdir = tempfile.mkdtemp(prefix=f'collexions-bench-{size}-')
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        config = C.compile_config(bench_config(base_url))
+        cache, history = C.CollectionCache(), C.PinHistory()
+        plex = C.connect_to_plex(config)
+        if plex is None: raise RuntimeError(f"Could not connect to fake server at {base_url}")
+        results = []
+        for cycle in range(1, cycles + 1):
+            _server_call(base_url, '/__reset')
+            random.seed(cycle)
+            tracemalloc.start()
+            start = time.perf_counter()
+            pinned = C.run_cycle(plex, config, cache, history)
+            wall = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            requests = _server_call(base_url, '/__stats')
+            results.append({'size': size, 'cycle': cycle, 'wall_seconds': round(wall, 4), 'peak_memory_kb': round(peak / 1024, 1),
+                            'requests_total': sum(requests.values()), 'requests': dict(sorted(requests.items())), 'pinned': len(pinned)})
+        return results
+    finally:
+        os.chdir(previous_dir)
+        process.terminate()
+
+def print_results(results):
+    print(f"{'size':>7} {'cycle':>5} {'wall s':>9} {'peak KiB':>10} {'requests':>9}")
+    for r in results:
+        print(f"{r['size']:>7} {r['cycle']:>5} {r['wall_seconds']:>9.3f} {r['peak_memory_kb']:>10.1f} {r['requests_total']:>9}")
+        for endpoint, count in r['requests'].items(): print(f"{'':>24}{count:>6}  {endpoint}")
+
+def compare(results, baseline, threshold):
+    """Returns a list of regressions against a baseline run (time/memory beyond threshold, any extra requests)."""
+    regressions = []
+    previous = {(r['size'], r['cycle']): r for r in baseline}
+    for r in results:
+        base = previous.get((r['size'], r['cycle']))
+        if base is None: continue
+        label = f"size={r['size']} cycle={r['cycle']}"
+        for metric in ('wall_seconds', 'peak_memory_kb'):
+            if base[metric] and r[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{label}: {metric} {base[metric]} -> {r[metric]}")
+        if r['requests_total'] > base['requests_total']:
+            regressions.append(f"{label}: requests_total {base['requests_total']} -> {r['requests_total']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a ColleXions pin cycle against an offline fake Plex server.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="collections per library to benchmark")
+    parser.add_argument('--cycles', type=int, default=1, help="consecutive cycles per size (later cycles use the warm cache)")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="baseline JSON from a previous --output run")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed relative slowdown / memory growth (default 0.25)")
+    parser.add_argument('--verbose', action='store_true', help="keep ColleXions INFO logging")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    # ColleXions writes its log and state files relative to the working directory; keep them out of the repo
+    os.chdir(tempfile.mkdtemp(prefix='collexions-bench-'))
+    import ColleXions as C
+    if not args.verbose: logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for size in args.sizes: results.extend(run_size(C, size, args.cycles))
+    print_results(results)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2)
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions: print(f"REGRESSION {line}")
+        if regressions: sys.exit(1)
+        print("No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
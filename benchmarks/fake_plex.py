@@ -0,0 +1,198 @@
+# --- Imports ---
+import re
+import json
+import time
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import quoteattr
+
+# --- Fake Plex Server ---
+# Serves just enough of the Plex API for a ColleXions cycle: server identity, library sections,
+# collection listings (with container pagination and simple filters), batched metadata,
+# managed hubs (visibility / promote / demote) and label edits. Every request is counted per endpoint.
+
+COLLECTION_TYPE = 18
+BASE_UPDATED_AT = 1700000000
+
+def _attrs(values):
+    return ' '.join(f'{k}={quoteattr(str(v))}' for k, v in values.items())
+
+class FakePlexState:
+    """Generated fixtures (sections, collections, managed hubs) plus per-endpoint request counters."""
+    def __init__(self, library_sizes, promoted_per_library=5, label='Collexions'):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.sections = {} # section id -> {'title', 'type', 'updatedAt', 'keys'}
+        self.collections = {} # ratingKey -> {'section', 'title', 'childCount', 'labels', 'updatedAt'}
+        self.hubs = {} # section id -> {ratingKey: {'home': bool, 'shared': bool}}
+        self.label_ids = {} # label title -> tag id, as Plex filters tags by id
+        rating_key = 1000
+        for section_id, (name, size) in enumerate(library_sizes.items(), start=1):
+            keys = []
+            for i in range(size):
+                rating_key += 1
+                keys.append(rating_key)
+                self.collections[rating_key] = {'section': section_id, 'title': f'{name} Collection {i}',
+                                                'childCount': (i * 7) % 40, 'labels': set(), 'updatedAt': BASE_UPDATED_AT + i}
+            self.sections[section_id] = {'title': name, 'type': 'movie', 'updatedAt': BASE_UPDATED_AT, 'keys': keys}
+            # Pretend a previous cycle pinned a few collections
+            self.hubs[section_id] = {}
+            for rk in keys[:promoted_per_library]:
+                self.hubs[section_id][rk] = {'home': True, 'shared': True}
+                self.collections[rk]['labels'].add(label)
+        self.label_id(label)
+
+    def label_id(self, title):
+        return self.label_ids.setdefault(title, 5000 + len(self.label_ids))
+
+    def count(self, method, path):
+        endpoint = re.sub(r'custom\.collection\.[\d.]+', '{hub}', path)
+        endpoint = re.sub(r'\d+(,\d+)*', '{id}', endpoint)
+        with self.lock: self.counts[f'{method} {endpoint}'] += 1
+
+    def stats(self):
+        with self.lock: return dict(self.counts)
+
+    def reset(self):
+        with self.lock: self.counts.clear()
+
+class FakePlexHandler(BaseHTTPRequestHandler):
+    """Request handler; the state is attached by serve()."""
+    state = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args): pass
+
+    def _send(self, body, code=200, content_type='text/xml'):
+        data = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _container(self, body='', **attrs):
+        return self._send(f'<?xml version="1.0" encoding="UTF-8"?><MediaContainer {_attrs(attrs)}>{body}</MediaContainer>')
+
+    def _collection_xml(self, rk):
+        c = self.state.collections[rk]
+        labels = ''.join(f'<Label tag={quoteattr(label)}/>' for label in sorted(c['labels']))
+        attrs = dict(ratingKey=rk, key=f'/library/collections/{rk}/children', type='collection', subtype='movie', title=c['title'],
+                     librarySectionID=c['section'], childCount=c['childCount'], updatedAt=c['updatedAt'], smart=0)
+        return f'<Directory {_attrs(attrs)}>{labels}</Directory>'
+
+    def _hub_xml(self, section_id, rk, hub):
+        attrs = dict(identifier=f'custom.collection.{section_id}.{rk}', title=self.state.collections[rk]['title'],
+                     promotedToOwnHome=int(hub['home']), promotedToSharedHome=int(hub['shared']), promotedToRecommended=0, deletable=1)
+        return f'<Hub {_attrs(attrs)}/>'
+
+    def _handle(self, method):
+        st = self.state
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+        query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        if path == '/__stats': return self._send(json.dumps(st.stats()), content_type='application/json')
+        if path == '/__reset': st.reset(); return self._send('{}', content_type='application/json')
+        st.count(method, path)
+
+        if path in ('/', '/identity'):
+            return self._container(friendlyName='FakePlex', machineIdentifier='fake-plex', version='1.40.0.0', myPlex=0)
+        if path in ('/library', '/library/sections'):
+            body = ''.join(f'<Directory {_attrs(dict(key=sid, title=s["title"], type=s["type"], agent="tv.plex.agents.movie", scanner="Plex Movie", language="en", uuid=f"section-{sid}", updatedAt=s["updatedAt"]))}/>'
+                           for sid, s in st.sections.items())
+            return self._container(body, size=len(st.sections))
+
+        m = re.fullmatch(r'/library/sections/(\d+)/(all|collections)', path)
+        if m and method == 'GET':
+            section_id = int(m.group(1))
+            start = int(self.headers.get('X-Plex-Container-Start') or query.get('X-Plex-Container-Start', 0))
+            size = int(self.headers.get('X-Plex-Container-Size') or query.get('X-Plex-Container-Size', 10 ** 9))
+            with st.lock:
+                keys = st.sections[section_id]['keys']
+                if 'label' in query:
+                    label = next((t for t, i in st.label_ids.items() if str(i) == query['label']), None)
+                    keys = [rk for rk in keys if label in st.collections[rk]['labels']]
+                if 'childCount>>' in query: keys = [rk for rk in keys if st.collections[rk]['childCount'] > int(query['childCount>>'])]
+                if 'updatedAt>>' in query: keys = [rk for rk in keys if st.collections[rk]['updatedAt'] > int(query['updatedAt>>'])]
+                page = keys[start:start + size]
+                body = ''.join(self._collection_xml(rk) for rk in page)
+            return self._container(body, size=len(page), totalSize=len(keys), offset=start, librarySectionID=section_id)
+        if m and method == 'PUT': # (multi-)edit: id=1,2,3 with label[i].tag.tag / label[].tag.tag- params
+            ids = [int(x) for x in query.get('id', '').split(',') if x]
+            add = [v for k, v in query.items() if re.fullmatch(r'label\[\d+\]\.tag\.tag', k)]
+            remove = [x for x in query.get('label[].tag.tag-', '').split(',') if x]
+            with st.lock:
+                for rk in ids:
+                    c = st.collections.get(rk)
+                    if c is None: continue
+                    c['labels'].update(add); c['labels'].difference_update(remove); c['updatedAt'] = int(time.time())
+                for label in add: st.label_id(label)
+            return self._container()
+
+        m = re.fullmatch(r'/library/sections/(\d+)/label', path)
+        if m: # label filter choices of a section
+            with st.lock:
+                titles = sorted({t for rk in st.sections[int(m.group(1))]['keys'] for t in st.collections[rk]['labels']})
+                body = ''.join(f'<Directory {_attrs(dict(key=st.label_id(t), title=t, fastKey=f"/library/sections/{m.group(1)}/all?label={st.label_id(t)}"))}/>' for t in titles)
+            return self._container(body, size=len(titles))
+
+        m = re.fullmatch(r'/library/sections/(\d+)', path)
+        if m:
+            section = st.sections[int(m.group(1))]
+            return self._container(librarySectionID=m.group(1), title1=section['title'], updatedAt=section['updatedAt'])
+
+        m = re.fullmatch(r'/library/(?:metadata|collections)/([\d,]+)', path)
+        if m:
+            with st.lock: body = ''.join(self._collection_xml(int(rk)) for rk in m.group(1).split(',') if int(rk) in st.collections)
+            return self._container(body, size=body.count('<Directory'))
+
+        m = re.fullmatch(r'/hubs/sections/(\d+)/manage(?:/custom\.collection\.\d+\.(\d+))?', path)
+        if m:
+            section_id = int(m.group(1))
+            with st.lock:
+                hubs = st.hubs[section_id]
+                if method == 'GET':
+                    if 'metadataItemId' in query:
+                        rk = int(query['metadataItemId'])
+                        body = self._hub_xml(section_id, rk, hubs[rk]) if rk in hubs else ''
+                    else:
+                        body = ''.join(self._hub_xml(section_id, rk, hub) for rk, hub in hubs.items())
+                    return self._container(body)
+                rk = int(m.group(2) or query.get('metadataItemId'))
+                if method == 'DELETE': hubs.pop(rk, None)
+                else:
+                    hub = hubs.setdefault(rk, {'home': False, 'shared': False})
+                    if 'promotedToOwnHome' in query: hub['home'] = query['promotedToOwnHome'] == '1'
+                    if 'promotedToSharedHome' in query: hub['shared'] = query['promotedToSharedHome'] == '1'
+            return self._container()
+
+        return self._send('<MediaContainer/>', 404)
+
+    def do_GET(self): self._handle('GET')
+    def do_PUT(self): self._handle('PUT')
+    def do_POST(self): self._handle('POST')
+    def do_DELETE(self): self._handle('DELETE')
+
+def serve(library_sizes, host='127.0.0.1', port=0, **kwargs):
+    """Starts a fake Plex server in a background thread; returns (server, state). server.server_port has the port."""
+    state = FakePlexState(library_sizes, **kwargs)
+    handler = type('BoundFakePlexHandler', (FakePlexHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-plex', daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a fake Plex server for local ColleXions testing.")
+    parser.add_argument('--port', type=int, default=32400)
+    parser.add_argument('--library', action='append', default=[], metavar='NAME=SIZE', help="e.g. Movies=1000 (repeatable)")
+    args = parser.parse_args()
+    sizes = dict((name, int(size)) for name, size in (item.split('=', 1) for item in args.library)) or {'Movies': 100, 'TV Shows': 50}
+    server, _ = serve(sizes, port=args.port)
+    print(f"Fake Plex listening on http://127.0.0.1:{server.server_port} with {sizes}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt: server.shutdown()